@@ -7,65 +7,54 @@ and generate new training file - 'parse_train_rare.dat'
 then execute
 python count_cfg_freq.py parse_train_rare.dat > cfg_rare.counts
 to generate new count file
+
+with --signatures, rare words are replaced by their signature class
+(_RARE_NUM_, _RARE_CAP_, ..., see vocab.word_class) instead, and
+5.py --signatures does the same at parse time
 """
-import sys, os
-import numpy as np
+import os
 import json
-import types
 import timeit
+import argparse
+import numpy as np
+
+import treebank
+from tree_walk import preorder
+from vocab import open_vocabulary, word_class, RARE, RARE_THRESHOLD
+
+VOCAB_FILE = 'cfg.vocab'
 
-def create_rare_word_list_from_training_file(count_file):
+def create_rare_word_list_from_training_file(count_file, threshold=RARE_THRESHOLD):
     """
-    read count file and return a list of rare words
+    read count file and return the set of rare words
     :param count_file: files created by run command line:
             python count cfg freqs.py parse train.dat > cfg.counts
-    :return: a list of unique rare words
+    :param threshold: words seen fewer times than this are rare
+    :return: a set of unique rare words
     """
-    lines = []
-    with open(count_file) as f:
-        for line in f:
-            thisline = line.split()
-            if thisline[1] == 'UNARYRULE':
-                lines.append(thisline[0])  #count
-                lines.append(thisline[3])  #word
-                lines.append(thisline[2])  # Part-of-speech tag
-
-    word_counts = np.asarray(lines)
-    word_counts = np.reshape(word_counts, (-1, 3)) # [count, word, tag]
-    counts = word_counts[:,0].astype('int')
-    #print counts
-    words = word_counts[:, 1]
-    rare_words = []
-    total_rare = 0
-    for w in words:
-        word_sum = np.sum(counts[words[:] == w])
-        #if w == 'Medical' :print 'medical counts', word_sum
-        if word_sum < 5 and w not in rare_words:
-            total_rare += word_sum
-            rare_words.append(w)
-    # print 'rare words appear %r times' % total_rare
-    return rare_words
+    return open_vocabulary(count_file, VOCAB_FILE, threshold).rare_words()
 
-def edit_training_file(train_file, rare_file):
+def edit_training_file(train_file, rare_file, threshold=RARE_THRESHOLD, signatures=False):
     """
     replace rare words with '_RARE_'
+    :param threshold: words seen fewer times than this are rare
+    :param signatures: replace them with their signature class instead
     :return:
     """
-    rare_words_list = create_rare_word_list_from_training_file("cfg.counts")
+    rare_words = create_rare_word_list_from_training_file("cfg.counts", threshold)
+    if treebank.is_treebank(train_file):
+        edit_treebank(treebank.Treebank(train_file), rare_file, rare_words, signatures)
+        return
     def modify_leaf(tree):
         """
-        recursivly find the leaf level terminal words in a tree
+        find the leaf level terminal words in a tree
         and replace it with "_RARE_" if the word is a rare word
         :param tree: a parse tree
         :return: the tree with low-frequency leaf words modified
         """
-        for idx, item in enumerate(tree):
-            if idx != 0:
-                if isinstance(item, types.ListType):
-                    modify_leaf(item)
-                else:
-                    if item in rare_words_list:
-                        tree[idx] = '_RARE_'
+        for node in preorder(tree):
+            if len(node) == 2 and node[1] in rare_words:
+                node[1] = signatures and word_class(node[1]) or RARE
         return tree
 
     newf = open(rare_file, 'w+')
@@ -77,8 +66,40 @@ def edit_training_file(train_file, rare_file):
     newf.close()
 # edit_training_file()
 
+def edit_treebank(trees, rare_file, rare_words, signatures=False):
+    """
+    replace rare words in a binary treebank by remapping the symbols of
+    its word nodes, the output is a binary treebank too
+    :param trees: a treebank.Treebank
+    :param rare_words: set of rare words
+    :param signatures: replace them with their signature class instead
+    """
+    names = list(trees.names)
+    index = dict((name, k) for k, name in enumerate(names))
+    # the symbol of every name when it is a word
+    replacement = []
+    for name in trees.names:
+        target = name in rare_words and (signatures and word_class(name) or RARE) or name
+        if target not in index:
+            index[target] = len(names)
+            names.append(target)
+        replacement.append(index[target])
+    words = trees.arity == 0
+    symbol = np.where(words, np.asarray(replacement)[trees.symbol], trees.symbol)
+    treebank.save_treebank(trees, rare_file, symbol, names)
+
 
 if __name__ == "__main__":
-    train_file = sys.argv[1]
-    rare_file = sys.argv[2]
-    edit_training_file(train_file, rare_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Replace rare words of a training file with '_RARE_'. "
+                    "A binary treebank (see treebank.py) gives a binary output.")
+    parser.add_argument('train_file')
+    parser.add_argument('rare_file')
+    parser.add_argument('--rare-threshold', type=int, default=RARE_THRESHOLD,
+                        help="words seen fewer times than this are rare")
+    parser.add_argument('--signatures', action='store_true',
+                        help="replace rare words by their signature class, "
+                             "see vocab.word_class")
+    args = parser.parse_args()
+    edit_training_file(args.train_file, args.rare_file, args.rare_threshold,
+                       args.signatures)
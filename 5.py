@@ -8,90 +8,33 @@ __date__ ="Mar 19, 2018"
 import sys, os
 import numpy as np
 import math
-import copy
 import itertools
 import re
 import time
 import json, pprint
+import argparse
+import multiprocessing
 
-def create_counts_iterator(count_file):
-    """
-    :param count_file: count file
-    :return: an iterator
-    """
-    l = count_file.readline()
-    while l:
-        line = l.strip().split()
-        if line[1] != 'WORDTAG':
-            #print line
-            yield line
-        l = count_file.readline()
-
-def build_rule_count_dict(counts_iterator):
-    """
-    build a dictionary with counts of each rule
-    :param counts_iterator: an iterator of count file
-    :return: {X: {w: 12, y1y2:13}}
-    """
-    rule_count_dict = {}
-    for l in counts_iterator:
-        if l[1] != 'NONTERMINAL':
-            x = l[2]
-            y = l[1] == 'UNARYRULE' and l[3] or l[3] + ' ' + l[4]
-            if x not in rule_count_dict:
-                rule_count_dict[x] = {}
-            rule_count_dict[x][y] = int(l[0])
-    return rule_count_dict
+import cky
+import pcfg
+import astar
+import kbest
+import coarse_to_fine
+from tree_walk import preorder
+from pcfg import create_counts_iterator, build_rule_count_dict, build_para_dict
+from vocab import open_vocabulary, rare_word, RARE_THRESHOLD, SIGNATURES
 
-def build_para_dict(rule_count_dict):
-    """
-    build a dictionary with probability of each rule
-    :param rule_count_dict: a dictionary with count of each rule
-    :return: {X: {w: 0.12, y1y2: 0.13}}
-    """
-    para_dict = copy.deepcopy(rule_count_dict)
-    for key in para_dict:
-        deno = sum(para_dict[key].values())
-        for subkey, count in para_dict[key].iteritems():
-            para_dict[key][subkey] = float(count)/deno
-    return para_dict
+RARE_COUNTS_FILE = 'cfg_rare.counts'
+COUNTS_FILE = 'cfg.counts'
+GRAMMAR_FILE = 'cfg_rare.pcfg'
+VOCAB_FILE = 'cfg.vocab'
 
 def calculate_parameter():
-    counts_iterator = create_counts_iterator(file('cfg_rare.counts'))
+    counts_iterator = create_counts_iterator(file(RARE_COUNTS_FILE))
     rule_count_dic = build_rule_count_dict(counts_iterator)
     para_dict = build_para_dict(rule_count_dic)
     return para_dict
 
-def create_frequent_word_list_from_training_file(count_file):
-    """
-    read original count file and return a list of frequent words
-    :param count_file: files created by run command line:
-            python count_cfg_freqs.py parse_train.dat > cfg.counts
-    :return: a list of unique frequent words
-    """
-    lines = []
-    with open(count_file) as f:
-        for line in f:
-            thisline = line.split()
-            if thisline[1] == 'UNARYRULE':
-                lines.append(thisline[0])  # count
-                lines.append(thisline[3])  # word
-                lines.append(thisline[2])  # Part-of-speech tag
-
-    word_counts = np.asarray(lines)
-    word_counts = np.reshape(word_counts, (-1, 3)) # [count, word, tag]
-    counts = word_counts[:,0].astype('int')
-    #print counts
-    words = word_counts[:, 1]
-    frequent_words = []
-    total_rare = 0
-    for w in words:
-        word_count = np.sum(counts[words[:] == w])
-        if word_count >= 5 and w not in frequent_words:
-            frequent_words.append(w)
-    # print 'rare words appear %r times' % total_rare
-    return frequent_words
-
 def create_sentence_iterator(corpus_file):
     with open(corpus_file) as f:
         l = f.readline()
@@ -105,24 +48,7 @@ def create_sentence_iterator(corpus_file):
             yield line
             l = f.readline()
 
-def init_memo_dict(n, parameters):
-    """
-    initialize memoization dictionary for dynamic programming,
-    all values are initialized to -1
-    :param n: length of a sentence
-    :param parameters: parameters of a PCFG, which is probability of each rule
-    :return: a dictionary in format of {i:{j:{x: -1}}}
-    """
-    memo_dict = {}
-    for i in range(1, n):
-        memo_dict[i] = {}
-        for j in range(i + 1, n + 1):
-            memo_dict[i][j] = {}
-            for x in parameters:
-                memo_dict[i][j][x] = -1.0
-    return memo_dict
-
-def pi(i, j, x, sentence, parameters, memo_pi_dict, memo_bp_dict):
+def pi(i, j, x, sentence, parameters, chart, lexicon=None):
     """
     implementation of PCFG algorithm
     :param i: start index
@@ -130,15 +56,20 @@ def pi(i, j, x, sentence, parameters, memo_pi_dict, memo_bp_dict):
     :param x: non-terminals in left-hand side of rule
     :param sentence: a sentence to parse, in format of list
     :param parameters: q(X -> Y1Y2) and q(x -> w), probability of each rule
-    :param memo_pi_dict: lookup dictionary for calculated pi values; {i: {j: {X: pi}}}
-    :param memo_bp_dict: backpointer dictionary of argmax s, Y1Y2;
-            {i: {j: {X: [s, [Y1, Y2]]}}}
+    :param chart: memoization of the calculated pi values and their
+            backpointers (argmax s, Y1Y2), {(i, j, X): (pi, [s, 'Y1 Y2'])}.
+            it starts empty and only holds the entries pi() reaches, the
+            backpointer is None if X has no binary rule
+    :param lexicon: optional pcfg.build_lexicon of parameters, to look
+            up the preterminals of a word at once
     :return: pi value for the given input
     """
     # print 'i, j, x: ', i, j, x
     # print memo_dict
     if i == j:
         w = sentence[i] # get the word at index i of input sentence
+        if lexicon is not None:
+            return lexicon.get(w, {}).get(x, 0.0)
         if x in parameters and w in parameters[x]: # if unary rule (x -> w) exists
             # print '11: ', parameters[x][w]
             # print w, x
@@ -147,9 +78,9 @@ def pi(i, j, x, sentence, parameters, memo_pi_dict, memo_bp_dict):
             # print '22'
             return 0.0
     else:
-        if memo_pi_dict[i][j][x] >= 0:  # if value of pi(i,j,x) has been calculated
-            # print '33: ', memo_dict[i][j][x]
-            return memo_pi_dict[i][j][x]
+        if (i, j, x) in chart:  # if value of pi(i,j,x) has been calculated
+            # print '33: ', chart[(i, j, x)]
+            return chart[(i, j, x)][0]
         else:   # if value of pi(i,j,x) has not been calculated
             # print '44'
 
@@ -159,73 +90,394 @@ def pi(i, j, x, sentence, parameters, memo_pi_dict, memo_bp_dict):
             binary_rules = filter(lambda x: len(x.split()) == 2, rules) # Y1, Y2
             # print binary_rules
             if binary_rules == []: # there's no binary rule under input X
-                memo_pi_dict[i][j][x] = 0.0
+                chart[(i, j, x)] = (0.0, None)
             else:
                 sub_pi_matrix = np.asarray(
                     [[parameters[x][r]
-                      * pi(i, s, r.split()[0], sentence, parameters, memo_pi_dict, memo_bp_dict)
-                      * pi(s + 1, j, r.split()[1], sentence, parameters, memo_pi_dict, memo_bp_dict)
+                      * pi(i, s, r.split()[0], sentence, parameters, chart, lexicon)
+                      * pi(s + 1, j, r.split()[1], sentence, parameters, chart, lexicon)
                       for s in range(i, j)]
                      for r in binary_rules]
                 ) # shape [len(binary_rules), (j-i)]
-                memo_pi_dict[i][j][x] = np.amax(sub_pi_matrix)
                 argmax_idx = np.argmax(sub_pi_matrix) # index of max value in flatten sub_pi matrix
                 argmax_s = i + argmax_idx % (j - i)   # value of s to get max value of pi
                 argmax_r = binary_rules[argmax_idx / (j - i)] # get Y1 Y2 that gives max value of pi
-                memo_bp_dict[i][j][x] = [argmax_s, argmax_r]
+                chart[(i, j, x)] = (np.amax(sub_pi_matrix), [argmax_s, argmax_r])
                 # print i, argmax_s, j, argmax_r
-            # print 'memo of %r, %r, %r: %r' % (i, j, x, memo_dict[i][j][x])
-            return memo_pi_dict[i][j][x]
+            # print 'memo of %r, %r, %r: %r' % (i, j, x, chart[(i, j, x)])
+            return chart[(i, j, x)][0]
 
-def build_parse_tree(sentence, i, j, x, bp_dict):
-    if i == j:
-        return sentence[i]
-    bp = bp_dict[i][j][x]
-    s = bp[0]
-    rule_left = bp[1].split()[0]
-    rule_right = bp[1].split()[1]
-    return [rule_left,build_parse_tree(sentence, i, s, rule_left, bp_dict)],\
-           [rule_right,build_parse_tree(sentence, s + 1, j, rule_right, bp_dict)]
+def build_parse_tree(sentence, i, j, x, chart):
+    """
+    the subtree of X over words i to j from the backpointers of pi(),
+    built top-down with an explicit stack
+    :return: the word if i == j, else ([Y1, subtree], [Y2, subtree])
+    """
+    root = [None]
+    # (i, j, X, list whose last slot gets the subtree of X)
+    stack = [(i, j, x, root)]
+    while stack:
+        i, j, x, parent = stack.pop()
+        if i == j:
+            parent[-1] = sentence[i]
+            continue
+        s, rule = chart[(i, j, x)][1]
+        rule_left, rule_right = rule.split()
+        left = [rule_left, None]
+        right = [rule_right, None]
+        parent[-1] = left, right
+        stack.append((s + 1, j, rule_right, right))
+        stack.append((i, s, rule_left, left))
+    return root[0]
 
-def parse_corpus(dev_file, prediction_file):
-    para_dict = calculate_parameter()
-    frequent_words = create_frequent_word_list_from_training_file("cfg.counts")
-    sentense_iterator = create_sentence_iterator(dev_file)
-    newf = open(prediction_file, 'w+')
-    total_s = 0
-    total_not_s = 0
-    for s in sentense_iterator:
-        total_s += 1
-        n = len(s) - 1
-        for i in range(1, n + 1):
-            if s[i] not in frequent_words:
-                s[i] = '_RARE_'
-        memo_pi_dict = init_memo_dict(n, para_dict) # memoization for pi value
-        memo_bp_dict = copy.deepcopy(memo_pi_dict)  # memoization for backpointer
+def tree_json(sentence, x, chart):
+    """
+    write the tree of X over the whole sentence as json straight from the
+    backpointers of pi(), see cky.tree_json
+    :return: the json string
+    """
+    n = len(sentence) - 1
+    pieces = []
+    stack = [(1, n, x)]
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            pieces.append(item)
+            continue
+        i, j, x = item
+        if i == j:
+            pieces.append('[%s, %s]' % (json.dumps(x), json.dumps(sentence[i])))
+            continue
+        s, rule = chart[(i, j, x)][1]
+        rule_left, rule_right = rule.split()
+        pieces.append('[%s, ' % json.dumps(x))
+        stack.extend([']', (s + 1, j, rule_right), ', ', (i, s, rule_left)])
+    return ''.join(pieces)
+
+def load_parser(engine='cky', grammar_file=GRAMMAR_FILE, rare_threshold=RARE_THRESHOLD,
+                instrument=False, signatures=False, **options):
+    """
+    load everything needed to parse a sentence
+    :param engine: 'cky' for the bottom-up vectorized engine in cky.py,
+            'astar' for the agenda-based parser in astar.py, 'pi' for the
+            recursive pi() above, 'coarse-to-fine' to prune the markovized
+            grammar of coarse_to_fine.py with this one
+    :param grammar_file: compiled grammar used by the 'cky' and 'astar'
+            engines and the coarse pass of 'coarse-to-fine', it is rebuilt
+            from the counts files when missing or stale
+    :param rare_threshold: words seen fewer times than this in training
+            are replaced by '_RARE_'
+    :param instrument: measure every sentence, see parse_sentence
+    :param signatures: replace rare words by their signature class (see
+            vocab.word_class) when the grammar has it, as 4.py
+            --signatures does in training
+    :param options: options of the 'cky' engine (beam, threshold, cache,
+            max_bytes for the memory-bounded mode of
+            cky.bounded_parse_chart, and kbest to write the kbest best
+            trees of every sentence instead of one, see parse_sentence)
+    :return: (engine, grammar, frequent_words, classes, options,
+            instrument), the grammar is a pcfg.Grammar for 'cky' and
+            'astar' and the parameter dictionary for 'pi'; classes are the
+            signature classes of the grammar, None without signatures;
+            'astar' options hold the outside estimates of the grammar and
+            'pi' options its pcfg.build_lexicon; for 'coarse-to-fine' the
+            grammar is the markovized one, and options hold the
+            InsideOutside of the coarse grammar, its projection and the
+            posterior threshold
+    """
+    if engine in ('cky', 'astar', 'coarse-to-fine'):
+        grammar, frequent_words = pcfg.open_grammar(RARE_COUNTS_FILE, COUNTS_FILE,
+                                                    grammar_file, rare_threshold)
+        if engine == 'astar':
+            options = dict(options, estimates=astar.Estimates(grammar))
+        elif engine == 'coarse-to-fine':
+            coarse = grammar
+            grammar = coarse_to_fine.open_fine_grammar(rare_threshold, signatures)[0]
+            options = dict(options, coarse=coarse_to_fine.InsideOutside(coarse),
+                           refines=coarse_to_fine.projection(coarse, grammar))
+        words = grammar.lexicon
+    else:
+        grammar = calculate_parameter()
+        frequent_words = open_vocabulary(COUNTS_FILE, VOCAB_FILE,
+                                         rare_threshold).frequent_words()
+        options = dict(options, lexicon=pcfg.build_lexicon(grammar))
+        words = options['lexicon']
+    classes = signatures and set(w for w in SIGNATURES if w in words) or None
+    return engine, grammar, frequent_words, classes, options, instrument
+
+def parse_sentence(s, parser):
+    """
+    :param s: a sentence from create_sentence_iterator
+    :param parser: as returned by load_parser
+    :return: (the json string of the best parse tree, {counter: value})
+            with the chart entries pruned and the span cache hits/misses;
+            an instrumented parser adds the length of the sentence, the
+            counters and phase timers of cky.new_stats and the total time.
+            with the kbest option, the json line of kbest.kbest_json
+            replaces the tree
+    """
+    engine, grammar, frequent_words, classes, options, instrument = parser
+    counters = {}
+    stats = None
+    if instrument:
+        start = time.time()
+        stats = cky.new_stats()
+    n = len(s) - 1
+    for i in range(1, n + 1):
+        if s[i] not in frequent_words:
+            s[i] = rare_word(s[i], classes)
+    if engine == 'cky':
+        k = options.get('kbest')
+        if k:
+            options = dict(options)
+            del options['kbest']
+        if options.get('max_bytes'):
+            chart, x = cky.bounded_parse_chart(s, grammar, stats=stats, **options)
+        else:
+            chart, x = cky.parse_chart(s, grammar, stats=stats, **options)
+        if instrument:
+            tree_start = time.time()
+        if k:
+            trees = x is not None and kbest.kbest_trees(s, chart, grammar, x, k) or []
+            tree = kbest.kbest_json(trees)
+        elif x is None:
+            tree = cky.right_branching_json(s, grammar)
+        else:
+            tree = cky.tree_json(s, x, chart, grammar)
+        counters = {'pruned': chart.pruned, 'cache_hits': chart.cache_hits,
+                    'cache_misses': chart.cache_misses}
+        if options.get('max_bytes'):
+            counters['memory_beam'] = int(chart.fallback == 'beam')
+            counters['default_trees'] = int(chart.fallback == 'default')
+    elif engine == 'astar':
+        chart, x = astar.parse_chart(s, grammar, options['estimates'], stats)
+        if instrument:
+            tree_start = time.time()
+        if x is None:
+            tree = cky.right_branching_json(s, grammar)
+        else:
+            tree = cky.tree_json(s, x, chart, grammar)
+        counters = {'popped': chart.popped,
+                    'chart_size': n * (n + 1) // 2 * grammar.n_symbols}
+    elif engine == 'coarse-to-fine':
+        chart, x = coarse_to_fine.parse_chart(
+            s, options['coarse'], grammar, options['refines'],
+            options.get('posterior', coarse_to_fine.THRESHOLD), stats)
+        if instrument:
+            tree_start = time.time()
+        if x is None:
+            tree = cky.right_branching_json(s, grammar)
+        else:
+            tree = cky.tree_json(s, x, chart, grammar)
+        counters = {'pruned': chart.pruned}
+    else:
+        para_dict = grammar
+        chart = {} # memoization for pi value and backpointer
         x = 'S'
-        prob = pi(1, n, x, s, para_dict, memo_pi_dict, memo_bp_dict)
+        lexicon = options['lexicon']
+        prob = pi(1, n, x, s, para_dict, chart, lexicon)
         if prob == 0.0:
             max_pi = -1.0
-            for key in memo_pi_dict[1][n]:
-                pi_x = memo_pi_dict[1][n][key]
+            for key in para_dict:
+                pi_x = pi(1, n, key, s, para_dict, chart, lexicon)
                 if pi_x > max_pi:
                     max_pi = pi_x
                     x = key
-        tree = str([x, build_parse_tree(s, 1, n, x, memo_bp_dict)])
-        tree = re.sub(r"(?<!\')(\(|\))(?!\')", "", tree)
-        tree = re.sub("'", "\"", tree)
-        tree = re.sub("\"\"\"\"", "\"''\"", tree)
-        tree = re.sub("\"\"", "\"'", tree)
-        tree = re.sub("n\"t", "n't", tree)
-        newf.write(tree + '\n')
-        total_not_s += 1
-        # print prob
-    newf.close()
+        if instrument:
+            stats = {'items': len(chart)}
+            tree_start = time.time()
+        tree = tree_json(s, x, chart)
+    if instrument:
+        # the tree is read out of the chart as it is serialized
+        stats['tree_seconds'] = stats.get('tree_seconds', 0.0) + time.time() - tree_start
+        counters.update(stats)
+        counters['words'] = n
+        counters['seconds'] = time.time() - start
+    return tree, counters
+
+def parse_batch(batch, parser):
+    """
+    parse sentences of the same length at once, see cky.batch_parse and
+    coarse_to_fine.parse_charts; the span cache option is not used
+    :param batch: sentences from create_sentence_iterator
+    :param parser: as returned by load_parser
+    :return: [(json string, {counter: value})] as parse_sentence returns
+            them, in the order of batch. instrumented counters and timers
+            are those of the whole batch divided evenly among its sentences
+    """
+    engine, grammar, frequent_words, classes, options, instrument = parser
+    if engine not in ('cky', 'coarse-to-fine'):
+        return [parse_sentence(s, parser) for s in batch]
+    stats = None
+    if instrument:
+        start = time.time()
+        stats = cky.new_stats()
+    for s in batch:
+        for i in range(1, len(s)):
+            if s[i] not in frequent_words:
+                s[i] = rare_word(s[i], classes)
+    if engine == 'cky':
+        charts = cky.batch_parse_charts(batch, grammar, options.get('beam'),
+                                        options.get('threshold'), stats)
+    else:
+        charts = coarse_to_fine.parse_charts(
+            batch, options['coarse'], grammar, options['refines'],
+            options.get('posterior', coarse_to_fine.THRESHOLD), stats)
+    if instrument:
+        tree_start = time.time()
+    results = []
+    for s, (chart, x) in zip(batch, charts):
+        counters = {'pruned': chart.pruned}
+        if engine == 'cky':
+            counters.update(cache_hits=chart.cache_hits, cache_misses=chart.cache_misses)
+        results.append((x is None and cky.right_branching_json(s, grammar)
+                        or cky.tree_json(s, x, chart, grammar), counters))
+    if instrument:
+        stats['tree_seconds'] += time.time() - tree_start
+        stats['seconds'] = time.time() - start
+        for s, (tree, counters) in zip(batch, results):
+            for key, value in stats.iteritems():
+                counters[key] = value / float(len(batch))
+            counters['words'] = len(s) - 1
+    return results
+
+def batch_bytes(n, parser):
+    """
+    :return: rough peak memory of a sentence of length n in parse_batch,
+            see cky.batch_bytes and coarse_to_fine.batch_bytes
+    """
+    engine, grammar, frequent_words, classes, options, instrument = parser
+    if engine == 'coarse-to-fine':
+        return coarse_to_fine.batch_bytes(n, options['coarse'].grammar, grammar)
+    return cky.batch_bytes(n, grammar)
+
+def create_batch_iterator(sentence_iterator, parser, max_bytes):
+    """
+    group sentences by length into batches of at most about max_bytes of
+    peak memory each, see batch_bytes; a batch is yielded once full, the
+    partial ones at the end
+    :return: iterator of (indices of the sentences in the input, sentences)
+    """
+    buckets = {}
+    for k, s in enumerate(sentence_iterator):
+        n = len(s) - 1
+        indices, batch = buckets.setdefault(n, ([], []))
+        indices.append(k)
+        batch.append(s)
+        if len(batch) >= max(1, max_bytes // batch_bytes(n, parser)):
+            yield buckets.pop(n)
+    for n in sorted(buckets):
+        yield buckets[n]
+
+def in_input_order(batches):
+    """
+    :param batches: iterator of (indices, results)
+    :return: iterator of the results in the order of their indices
+    """
+    pending = {}
+    k = 0
+    for indices, results in batches:
+        pending.update(zip(indices, results))
+        while k in pending:
+            yield pending.pop(k)
+            k += 1
+
+# parser of the worker processes. it is set before the pool is created,
+# so forked workers share the loaded grammar instead of unpickling it
+_parser = None
+
+def parse_chunk(chunk):
+    return [parse_sentence(s, _parser) for s in chunk]
+
+def parse_indexed_batch(indexed_batch):
+    indices, batch = indexed_batch
+    return indices, parse_batch(batch, _parser)
+
+def create_chunk_iterator(sentence_iterator, chunk_size):
+    while True:
+        chunk = list(itertools.islice(sentence_iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def parse_corpus(dev_file, prediction_file, engine='cky', grammar_file=GRAMMAR_FILE,
+                 workers=1, chunk_size=32, rare_threshold=RARE_THRESHOLD,
+                 stats_file=None, batch_memory=None, signatures=False, **options):
+    """
+    parse every sentence of dev_file and write one json tree per line, or
+    one json list of [log probability, tree] per line with the kbest option
+    :param engine: 'cky', 'astar', 'pi' or 'coarse-to-fine', see load_parser
+    :param grammar_file: compiled grammar used by the 'cky' engine
+    :param workers: number of worker processes, sentences are sent to
+            them in chunks of chunk_size and written back in input order
+    :param rare_threshold: see load_parser
+    :param stats_file: if given, every sentence is instrumented and its
+            counters and timers are written there as one json line,
+            followed by a last line {"summary": totals}
+    :param batch_memory: if given, the 'cky' and 'coarse-to-fine' engines
+            parse sentences of the same length in batches of about this
+            many bytes of peak memory, see parse_batch; workers are then
+            sent whole batches
+    :param signatures: see load_parser
+    :param options: pruning and cache options of the 'cky' engine, see
+            cky.parse, or the posterior threshold of 'coarse-to-fine'
+    :return: {'sentences': number of sentences, 'pruned': chart entries pruned,
+            'cache_hits': .., 'cache_misses': ..}, plus the totals of the
+            instrumentation counters and timers when stats_file is given
+    """
+    global _parser
+    _parser = load_parser(engine, grammar_file, rare_threshold,
+                          stats_file is not None, signatures, **options)
+    sentense_iterator = create_sentence_iterator(dev_file)
+    pool = None
+    if batch_memory and engine in ('cky', 'coarse-to-fine'):
+        batches = create_batch_iterator(sentense_iterator, _parser, batch_memory)
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            batches = pool.imap_unordered(parse_indexed_batch, batches)
+        else:
+            batches = itertools.imap(parse_indexed_batch, batches)
+        trees = in_input_order(batches)
+    elif workers > 1:
+        pool = multiprocessing.Pool(workers)
+        chunks = pool.imap(parse_chunk,
+                           create_chunk_iterator(sentense_iterator, chunk_size))
+        trees = itertools.chain.from_iterable(chunks)
+    else:
+        trees = (parse_sentence(s, _parser) for s in sentense_iterator)
+    stats = {'sentences': 0, 'pruned': 0, 'cache_hits': 0, 'cache_misses': 0}
+    newf = open(prediction_file, 'w+')
+    statsf = stats_file and open(stats_file, 'w')
+    done = False
+    try:
+        for tree, counters in trees:
+            newf.write(tree + '\n')
+            stats['sentences'] += 1
+            for key, value in counters.iteritems():
+                stats[key] = stats.get(key, 0) + value
+            if statsf:
+                counters['sentence'] = stats['sentences']
+                statsf.write(json.dumps(counters, sort_keys=True) + '\n')
+        if statsf:
+            statsf.write(json.dumps({'summary': stats}, sort_keys=True) + '\n')
+        done = True
+    finally:
+        newf.close()
+        if statsf:
+            statsf.close()
+        if pool is not None:
+            # a failed or interrupted run must not leave workers behind
+            if done:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+    return stats
 
 def testing():
     para_dict = calculate_parameter()
     # print para_dict
-    frequent_words = create_frequent_word_list_from_training_file("cfg.counts")
+    frequent_words = open_vocabulary(COUNTS_FILE, VOCAB_FILE).frequent_words()
     s = ['', 'The', 'complicated', 'language', 'in', 'the', 'huge',
          'new', 'law', 'has', 'muddied', 'the', 'fight', '.']
     for i in range(1, len(s)):
@@ -234,13 +486,12 @@ def testing():
     print s
     n = len(s) - 1
     prob = -2.0
-    memo_pi_dict = init_memo_dict(n, para_dict)
-    memo_bp_dict = copy.deepcopy(memo_pi_dict)
-    prob = pi(1, n, 'S', s, para_dict, memo_pi_dict, memo_bp_dict)
+    chart = {}
+    prob = pi(1, n, 'S', s, para_dict, chart)
     # print 'prob,', prob
     tree = ['']
-    if memo_pi_dict[1][n]['S'] != 0:
-        tree= str(['S', build_parse_tree(s, 1, n, 'S', memo_bp_dict)])
+    if prob != 0:
+        tree= str(['S', build_parse_tree(s, 1, n, 'S', chart)])
         tree = re.sub(r"(?<!\')(\(|\))(?!\')", "", tree)
         tree = re.sub("'", "\"", tree)
         s = json.loads(tree)
@@ -248,12 +499,12 @@ def testing():
     else:
         max_pi = -1.0
         x = 'X'
-        for key in memo_pi_dict[1][n]:
-            pi_value = memo_pi_dict[1][n][key]
+        for key in para_dict:
+            pi_value = pi(1, n, key, s, para_dict, chart)
             if pi_value > max_pi:
                 max_pi = pi_value
                 x = key
-        tree = [x, build_parse_tree(s, 1, n, x, memo_bp_dict)]
+        tree = [x, build_parse_tree(s, 1, n, x, chart)]
     print 'tree:', tree
 
 class Node:
@@ -267,12 +518,10 @@ def format_tree(tree):
   """
   Convert a tree with strings, to one with nodes.
   """
-  tree[0] = Node(tree[0])
-  if len(tree) == 2:
-    tree[1] = Node(tree[1])
-  elif len(tree) == 3:
-    format_tree(tree[1])
-    format_tree(tree[2])
+  for node in preorder(tree):
+    node[0] = Node(node[0])
+    if len(node) == 2:
+      node[1] = Node(node[1])
 
 def pretty_print_tree(tree):
   """
@@ -282,11 +531,74 @@ def pretty_print_tree(tree):
   print pprint.pformat(tree)
 
 if __name__ == "__main__":
-    # start =time.time()
+    parser = argparse.ArgumentParser(description="Parse a corpus with a PCFG.")
+    parser.add_argument('rare_file')
+    parser.add_argument('dev_file')
+    parser.add_argument('prediction_file')
+    parser.add_argument('--engine', choices=['cky', 'astar', 'pi', 'coarse-to-fine'],
+                        default='cky',
+                        help="bottom-up vectorized CKY, agenda-based A* search, "
+                             "the recursive pi() or CKY with the markovized grammar "
+                             "pruned by this one")
+    parser.add_argument('--grammar', default=GRAMMAR_FILE,
+                        help="compiled grammar file for the cky engine")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of parsing processes")
+    parser.add_argument('--chunk-size', type=int, default=32,
+                        help="sentences sent to a worker at a time")
+    parser.add_argument('--rare-threshold', type=int, default=RARE_THRESHOLD,
+                        help="words seen fewer times than this in training are rare")
+    parser.add_argument('--beam', type=int, default=None,
+                        help="keep at most this many entries per chart cell "
+                             "of a span longer than 1")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="prune entries below this fraction of the best one in their cell")
+    parser.add_argument('--span-cache', type=float, default=None, metavar='MB',
+                        help="reuse the cells of spans seen in earlier sentences, "
+                             "keeping at most this many megabytes of them")
+    parser.add_argument('--batch-memory', type=float, default=None, metavar='MB',
+                        help="parse sentences of the same length together in "
+                             "batches of about this many megabytes (cky and "
+                             "coarse-to-fine engines)")
+    parser.add_argument('--max-memory', type=float, default=None, metavar='MB',
+                        help="parse every sentence in a compact chart of at most "
+                             "this many megabytes, narrowing the beam or writing "
+                             "a right-branching tree when it does not fit")
+    parser.add_argument('--signatures', action='store_true',
+                        help="replace rare words by their signature class, for "
+                             "counts made with 4.py --signatures")
+    parser.add_argument('--kbest', type=int, default=None, metavar='K',
+                        help="write the K best trees of every sentence, one json "
+                             "list of [log probability, tree] per line (cky engine)")
+    parser.add_argument('--posterior-threshold', type=float,
+                        default=coarse_to_fine.THRESHOLD,
+                        help="keep the coarse items with at least this posterior "
+                             "(coarse-to-fine engine)")
+    parser.add_argument('--stats', default=None, metavar='FILE',
+                        help="write the counters and phase timings of every "
+                             "sentence to FILE as json lines, then a summary")
+    args = parser.parse_args()
+    if args.batch_memory and (args.span_cache
+                              or args.engine not in ('cky', 'coarse-to-fine')):
+        parser.error("--batch-memory only works with the cky and coarse-to-fine engines, "
+                     "without --span-cache")
+    if args.max_memory and (args.span_cache or args.batch_memory or args.engine != 'cky'):
+        parser.error("--max-memory only works with the cky engine, "
+                     "without --span-cache or --batch-memory")
+    if args.kbest and (args.batch_memory or args.max_memory or args.engine != 'cky'):
+        parser.error("--kbest only works with the cky engine, "
+                     "without --batch-memory or --max-memory")
+    if args.engine == 'astar' and (args.beam or args.threshold or args.span_cache):
+        parser.error("the astar engine is exact, it takes no pruning or span cache")
+    if args.engine == 'coarse-to-fine' and (args.beam or args.threshold or args.span_cache
+                                            or args.max_memory):
+        parser.error("the coarse-to-fine engine prunes by posterior, "
+                     "see --posterior-threshold")
+    start = time.time()
 
-    rare_file = sys.argv[1]
-    dev_file = sys.argv[2]
-    prediction_file = sys.argv[3]
+    rare_file = args.rare_file
+    dev_file = args.dev_file
+    prediction_file = args.prediction_file
     # rare_file = "parse_train.RARE.dat"
     # dev_file = "parse_dev.dat"
     # prediction_file ="q5_prediction_file"
@@ -295,9 +607,48 @@ if __name__ == "__main__":
     # print prediction_file
 
     # testing()
-    parse_corpus(dev_file, prediction_file)
-    # end = time.time()
-    # print "running time %r s" % (end-start)
+    options = {}
+    if args.beam:
+        options['beam'] = args.beam
+    if args.threshold:
+        options['threshold'] = args.threshold
+    if args.span_cache:
+        options['cache'] = cky.SpanCache(int(args.span_cache * (1 << 20)))
+    if args.max_memory:
+        options['max_bytes'] = int(args.max_memory * (1 << 20))
+    if args.kbest:
+        options['kbest'] = args.kbest
+    if args.engine == 'coarse-to-fine':
+        options['posterior'] = args.posterior_threshold
+    stats = parse_corpus(dev_file, prediction_file, args.engine, args.grammar,
+                         args.workers, args.chunk_size, args.rare_threshold,
+                         args.stats,
+                         args.batch_memory and int(args.batch_memory * (1 << 20)),
+                         args.signatures, **options)
+    end = time.time()
+    sys.stderr.write("running time %r s\n" % (end - start))
+    if args.beam or args.threshold:
+        sys.stderr.write("pruned %d chart entries\n" % stats['pruned'])
+    if args.engine == 'coarse-to-fine':
+        sys.stderr.write("pruned %d coarse items\n" % stats['pruned'])
+    if args.span_cache:
+        sys.stderr.write("span cache: %d hits, %d misses\n"
+                         % (stats['cache_hits'], stats['cache_misses']))
+    if args.engine == 'astar':
+        sys.stderr.write("popped %d items of a full chart of %d (%.1f%%)\n"
+                         % (stats['popped'], stats['chart_size'],
+                            100.0 * stats['popped'] / max(stats['chart_size'], 1)))
+    if args.max_memory:
+        sys.stderr.write("memory budget: %d sentences parsed with a narrower beam, "
+                         "%d right-branching trees\n"
+                         % (stats['memory_beam'], stats['default_trees']))
+    if args.stats:
+        sys.stderr.write("%d cells, %d rule applications, %d chart items\n"
+                         % (stats.get('cells', 0), stats.get('rule_applications', 0),
+                            stats['items']))
+        for phase in ('lexical', 'span', 'tree'):
+            if phase + '_seconds' in stats:
+                sys.stderr.write("%s: %.3f s\n" % (phase, stats[phase + '_seconds']))
 
     # line_num = 0
     # with open(prediction_file) as f:
@@ -0,0 +1,201 @@
+"""
+Agenda-based A* Viterbi parser over an integer-indexed Grammar (see pcfg.py)
+
+items (i, j, X) are popped best first, by their inside score times an
+upper bound on their outside score that only depends on X and on the
+number of words around the span. the bounds are computed once per
+grammar, so a sentence with a clear best parse stops long before the
+whole chart is built. the tree is read back with the
+tie-breaks of cky.fill_span, so the output is the same as cky.py's.
+"""
+
+import heapq
+import time
+import numpy as np
+
+import cky
+
+# items within this fraction of the goal's priority are still popped after
+# it, so that rounding in the products cannot hide a tie of the best tree
+TOLERANCE = 1e-9
+
+class Estimates(object):
+    """
+    outside bounds of a grammar that only depend on the number of words
+    left and right of a span (the SX estimate of Klein and Manning):
+    outside(l, r)[X] is the best score of any tree around X with l words
+    on its left and r on its right, up to the root. it bounds the outside
+    score of X over any span with that context, which makes it an
+    admissible A* heuristic. tables are extended to longer sentences as
+    they come.
+    """
+    def __init__(self, grammar, root='S'):
+        self.grammar = grammar
+        self.root = grammar.index[root]
+        self.n = 0
+        # rules by the symbol of their left and of their right child
+        self.by_left = [np.flatnonzero(grammar.rule_left == y)
+                        for y in range(grammar.n_symbols)]
+        self.by_right = [np.flatnonzero(grammar.rule_right == y)
+                         for y in range(grammar.n_symbols)]
+
+    def extend(self, n):
+        """
+        compute the tables for sentences of up to n words:
+        inside[k, X], the best score of X over any k words, and
+        outside[l, r, X]
+        """
+        if n <= self.n:
+            return
+        g = self.grammar
+        inside = np.zeros((n + 1, g.n_symbols))
+        for tags, probs in g.lexicon.itervalues():
+            np.maximum.at(inside[1], tags, probs)
+        for k in range(2, n + 1):
+            # [a, rule], a words under the left child
+            scores = g.rule_prob * inside[1:k][:, g.rule_left] \
+                     * inside[k - 1:0:-1][:, g.rule_right]
+            np.maximum.at(inside[k], g.rule_lhs, scores.max(axis=0))
+        outside = np.zeros((n, n, g.n_symbols))
+        outside[0, 0, self.root] = 1.0
+        for c in range(1, n):
+            for l in range(0, c + 1):
+                r = c - l
+                if r:
+                    # the parent covers k more words on the right
+                    scores = outside[l, r - 1::-1][:, g.rule_lhs] * g.rule_prob \
+                             * inside[1:r + 1][:, g.rule_right]
+                    np.maximum.at(outside[l, r], g.rule_left, scores.max(axis=0))
+                if l:
+                    scores = outside[l - 1::-1, r][:, g.rule_lhs] * g.rule_prob \
+                             * inside[1:l + 1][:, g.rule_left]
+                    np.maximum.at(outside[l, r], g.rule_right, scores.max(axis=0))
+        self.inside = inside
+        self.outside = outside
+        self.n = n
+
+def parse(sentence, grammar, estimates):
+    """
+    pop items best first until the goal (1, n, S) is popped, then go on
+    while the agenda holds items as good as the goal
+    :param sentence: a sentence as for cky.parse
+    :param estimates: Estimates of the grammar
+    :return: (inside scores of the popped items, a [i, j, X] array,
+            number of items popped)
+    """
+    n = len(sentence) - 1
+    estimates.extend(n)
+    outside = estimates.outside
+    rule_lhs = grammar.rule_lhs
+    rule_left = grammar.rule_left
+    rule_right = grammar.rule_right
+    rule_prob = grammar.rule_prob
+    # best inside score found so far, and the final one of popped items
+    beta = np.zeros((n + 2, n + 2, grammar.n_symbols))
+    done = np.zeros((n + 2, n + 2, grammar.n_symbols))
+    agenda = []
+    for i in range(1, n + 1):
+        if sentence[i] in grammar.lexicon:
+            tags, probs = grammar.lexicon[sentence[i]]
+            for x, p in zip(tags.tolist(), probs.tolist()):
+                beta[i, i, x] = p
+                agenda.append((-p * outside[i - 1, n - i, x], p, i, i, x))
+    heapq.heapify(agenda)
+    goal = None
+    popped = 0
+    while agenda:
+        priority, b, i, j, x = heapq.heappop(agenda)
+        priority = -priority
+        if goal is not None and priority < goal * (1.0 - TOLERANCE):
+            break
+        if b != beta[i, j, x] or done[i, j, x] == b:
+            continue # improved or popped since it was pushed
+        done[i, j, x] = b
+        popped += 1
+        if goal is None and i == 1 and j == n and x == estimates.root:
+            goal = priority
+
+        # x as the left child of items (i, k), the right child of items (h, j)
+        parents = []
+        if j < n:
+            rs = estimates.by_left[x]
+            # [k - j - 1, rule], same product order as pi()
+            scores = rule_prob[rs] * b * done[j + 1, j + 1:n + 1][:, rule_right[rs]]
+            k, r = np.nonzero(scores)
+            parents.append((np.repeat(i, len(k)), j + 1 + k, rule_lhs[rs[r]], scores[k, r]))
+        if i > 1:
+            rs = estimates.by_right[x]
+            scores = rule_prob[rs] * done[1:i, i - 1][:, rule_left[rs]] * b
+            h, r = np.nonzero(scores)
+            parents.append((1 + h, np.repeat(j, len(h)), rule_lhs[rs[r]], scores[h, r]))
+        for starts, ends, xs, scores in parents:
+            better = scores > beta[starts, ends, xs]
+            for start, end, y, score in zip(starts[better].tolist(), ends[better].tolist(),
+                                            xs[better].tolist(), scores[better].tolist()):
+                if score > beta[start, end, y]:
+                    beta[start, end, y] = score
+                    # never above the item being popped, which rounding
+                    # of the bound could otherwise cause
+                    heapq.heappush(agenda, (-min(score * outside[start - 1, n - end, y],
+                                                 priority),
+                                            score, start, end, y))
+    return done, popped
+
+def best_entry(i, j, x, done, grammar):
+    """
+    :return: (split, rule) of the first rule of X and split point, in the
+            order of cky.fill_span, that gives the score of (i, j, X)
+    """
+    k = np.searchsorted(grammar.group_lhs, x)
+    rs = grammar.rule_ids[grammar.group_start[k]:grammar.group_start[k] + grammar.group_len[k]]
+    # [rule, split]
+    scores = grammar.rule_prob[rs, None] \
+             * done[i, i:j][:, grammar.rule_left[rs]].T \
+             * done[i + 1:j + 1, j][:, grammar.rule_right[rs]].T
+    first = np.flatnonzero(scores.ravel() == done[i, j, x])[0]
+    return i + first % (j - i), rs[first // (j - i)]
+
+def parse_chart(sentence, grammar, estimates, stats=None):
+    """
+    :param stats: optional cky.new_stats() counters and timers, the items
+            popped are counted as chart items
+    :return: (a cky.Chart holding the entries of the Viterbi tree only,
+            index of the root nonterminal or None if the sentence has
+            no parse), read by cky.tree_json.
+            chart.popped is the number of items popped
+    """
+    if stats is not None:
+        start = time.time()
+    done, popped = parse(sentence, grammar, estimates)
+    if stats is not None:
+        stats['items'] += popped
+        now = time.time()
+        stats['span_seconds'] += now - start
+        start = now
+    n = len(sentence) - 1
+    chart = cky.Chart(n)
+    chart.popped = popped
+    x = estimates.root
+    if not done[1, n, x]:
+        # no S over the sentence: the agenda was emptied, so every item
+        # is there and the best one wins as in cky.best_root
+        if not done[1, n].any():
+            return chart, None
+        x = int(np.argmax(done[1, n]))
+    stack = [(1, n, x)]
+    while stack:
+        i, j, y = stack.pop()
+        if i == j or not done[i, j, y]:
+            continue
+        s, r = best_entry(i, j, y, done, grammar)
+        cell = np.zeros(1, dtype=cky.ENTRY)
+        cell['x'] = y
+        cell['score'] = done[i, j, y]
+        cell['split'] = s
+        cell['rule'] = r
+        chart.cells[(i, j)] = cell
+        stack.append((i, s, grammar.rule_left[r]))
+        stack.append((s + 1, j, grammar.rule_right[r]))
+    if stats is not None:
+        stats['tree_seconds'] += time.time() - start
+    return chart, x
@@ -0,0 +1,57 @@
+#! /usr/bin/python
+"""
+Measure the speed/accuracy trade-off of CKY chart pruning.
+
+parse the dev file once per (beam, threshold) setting and print a
+tab-separated table of sentences per second and F1 score against the
+key file, ready to be plotted
+"""
+
+import sys
+import argparse
+import itertools
+
+from scripts import parser_script, parse_and_evaluate
+
+parser_module = parser_script()
+
+def run_setting(dev_file, key_file, grammar_file, workers, beam, threshold):
+    """
+    parse dev_file with one pruning setting and evaluate it
+    :return: (seconds, sentences, pruned entries, precision, recall, F1)
+    """
+    options = {}
+    if beam:
+        options['beam'] = beam
+    if threshold:
+        options['threshold'] = threshold
+    seconds, stats, p, r, f = parse_and_evaluate(dev_file, key_file, 'cky', grammar_file,
+                                                 workers, **options)
+    return seconds, stats['sentences'], stats['pruned'], p, r, f
+
+def main(dev_file, key_file, beams, thresholds, grammar_file, workers):
+    # compile the grammar up front so the first setting is not charged for it
+    parser_module.load_parser('cky', grammar_file)
+    print "\t".join(["beam", "threshold", "seconds", "sentences/s",
+                     "pruned", "precision", "recall", "F1"])
+    for beam, threshold in itertools.product(beams, thresholds):
+        seconds, sentences, pruned, p, r, f = run_setting(
+            dev_file, key_file, grammar_file, workers, beam, threshold)
+        print "%d\t%g\t%.3f\t%.1f\t%d\t%.4f\t%.4f\t%.4f" % (
+            beam, threshold, seconds, sentences / seconds, pruned, p, r, f)
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="F1 against parsing speed for chart pruning settings.")
+    parser.add_argument('dev_file')
+    parser.add_argument('key_file')
+    parser.add_argument('--beam', type=int, nargs='+', default=[0],
+                        help="beam widths, 0 for no beam")
+    parser.add_argument('--threshold', type=float, nargs='+', default=[0.0],
+                        help="relative thresholds, 0 for no threshold")
+    parser.add_argument('--grammar', default=parser_module.GRAMMAR_FILE)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    main(args.dev_file, args.key_file, args.beam, args.threshold, args.grammar,
+         args.workers)
@@ -0,0 +1,295 @@
+#! /usr/bin/python
+"""
+Benchmark parsing, counting, rare-word rewriting and evaluation.
+
+every task runs in its own process on the bundled data and reports wall
+time, sentences (or trees) per second and peak RSS; parsing is also timed
+sentence by sentence and bucketed by length, to show the cubic scaling.
+the tree_walk task compares the per-node cost of the explicit-stack tree
+walks (Counts.count, eval_parser.convert_to_spans and the tree_walk.py
+walkers) with the recursive functions they replaced. results are written
+as json, so two versions can be diffed:
+python benchmark.py --output before.json
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import tree_walk
+import eval_parser
+import count_cfg_freq
+from scripts import HERE, load_script, parser_script
+
+def count_lines(path):
+    with open(path) as f:
+        return sum(1 for l in f)
+
+class quiet(object):
+    """
+    send stdout to /dev/null, the tools print their results
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def task_parse_corpus(args):
+    parser_module = parser_script()
+    parser_module.load_parser(args.engine, args.grammar) # compile outside the timing
+    start = time.time()
+    parser_module.parse_corpus(args.dev_file, args.prediction_file, args.engine,
+                               args.grammar, args.workers)
+    return time.time() - start, count_lines(args.dev_file), {}
+
+def task_parse_by_length(args):
+    parser_module = parser_script()
+    parser = parser_module.load_parser(args.engine, args.grammar)
+    buckets = {}
+    total = 0.0
+    sentences = 0
+    for s in parser_module.create_sentence_iterator(args.dev_file):
+        n = len(s) - 1
+        start = time.time()
+        parser_module.parse_sentence(s, parser)
+        seconds = time.time() - start
+        total += seconds
+        sentences += 1
+        low = (n - 1) // args.bucket * args.bucket + 1
+        bucket = buckets.setdefault('%d-%d' % (low, low + args.bucket - 1),
+                                    {'sentences': 0, 'seconds': 0.0})
+        bucket['sentences'] += 1
+        bucket['seconds'] += seconds
+    for bucket in buckets.itervalues():
+        bucket['ms_per_sentence'] = 1000.0 * bucket['seconds'] / bucket['sentences']
+    return total, sentences, {'buckets': buckets}
+
+def task_count(args):
+    start = time.time()
+    with quiet():
+        count_cfg_freq.main(args.train_file)
+    return time.time() - start, count_lines(args.train_file), {}
+
+def task_rare(args):
+    rare_module = load_script('rare_4', '4.py')
+    fd, rare_file = tempfile.mkstemp(suffix='.dat')
+    os.close(fd)
+    try:
+        start = time.time()
+        rare_module.edit_training_file(args.train_file, rare_file)
+        seconds = time.time() - start
+    finally:
+        os.remove(rare_file)
+    return seconds, count_lines(args.train_file), {}
+
+def task_eval(args):
+    if not os.path.getsize(args.prediction_file):
+        # parse_corpus was not run, make the predictions outside the timing
+        parser_module = parser_script()
+        parser_module.parse_corpus(args.dev_file, args.prediction_file, args.engine,
+                                   args.grammar, args.workers)
+    start = time.time()
+    with quiet():
+        eval_parser.main(args.key_file, args.prediction_file)
+    return time.time() - start, count_lines(args.key_file), {}
+
+# the recursive versions of Counts.count, eval_parser.convert_to_spans,
+# the modify_leaf of 4.py and format_tree, for the tree_walk task
+
+def recursive_count(counts, tree):
+    symbol = tree[0]
+    counts.nonterm.setdefault(symbol, 0)
+    counts.nonterm[symbol] += 1
+    if len(tree) == 3:
+        key = (symbol, tree[1][0], tree[2][0])
+        counts.binary.setdefault(key, 0)
+        counts.binary[key] += 1
+        recursive_count(counts, tree[1])
+        recursive_count(counts, tree[2])
+    elif len(tree) == 2:
+        key = (symbol, tree[1])
+        counts.unary.setdefault(key, 0)
+        counts.unary[key] += 1
+
+def recursive_spans(tree, start, spans):
+    if len(tree) == 3:
+        split = recursive_spans(tree[1], start, spans)
+        end = recursive_spans(tree[2], split + 1, spans)
+        spans.add((eval_parser.simplify_non_terminal(tree[0]), start, end))
+        return end
+    spans.add((eval_parser.simplify_non_terminal(tree[0]), start, start))
+    return start
+
+def recursive_leaves(tree, rare_words):
+    for idx, item in enumerate(tree):
+        if idx != 0:
+            if isinstance(item, list):
+                recursive_leaves(item, rare_words)
+            elif item in rare_words:
+                tree[idx] = '_RARE_'
+
+def recursive_format(tree):
+    tree[0] = str(tree[0])
+    if len(tree) == 2:
+        tree[1] = str(tree[1])
+    elif len(tree) == 3:
+        recursive_format(tree[1])
+        recursive_format(tree[2])
+
+def walker_count(counts, tree):
+    counts.count(tree)
+
+def walker_leaves(tree, rare_words):
+    for node in tree_walk.preorder(tree):
+        if len(node) == 2 and node[1] in rare_words:
+            node[1] = '_RARE_'
+
+def walker_format(tree):
+    for node in tree_walk.preorder(tree):
+        node[0] = str(node[0])
+        if len(node) == 2:
+            node[1] = str(node[1])
+
+def right_branching(n):
+    """
+    :return: a json tree of n words, n - 1 levels deep
+    """
+    tree = ['X', 'w']
+    for k in range(n - 1):
+        tree = ['X', ['X', 'w'], tree]
+    return tree
+
+def task_tree_walk(args):
+    with open(args.train_file) as f:
+        lines = f.readlines()
+    nodes = sum(1 for l in lines for node in tree_walk.preorder(json.loads(l)))
+    rare_words = set(['the', 'of'])
+    operations = [
+        ('count', lambda tree, f: f(count_cfg_freq.Counts(), tree),
+         recursive_count, walker_count),
+        ('spans', lambda tree, f: f(tree, 1, set()), recursive_spans,
+         eval_parser.convert_to_spans),
+        ('rare_words', lambda tree, f: f(tree, rare_words),
+         recursive_leaves, walker_leaves),
+        ('format_tree', lambda tree, f: f(tree), recursive_format, walker_format),
+    ]
+    per_node = {}
+    total = 0.0
+    for name, call, recursive, walker in operations:
+        per_node[name] = {}
+        for version, f in (('recursive', recursive), ('walker', walker)):
+            seconds = None
+            for k in range(3):
+                # fresh trees, the operations change them in place
+                trees = [json.loads(l) for l in lines]
+                gc.disable()
+                start = time.time()
+                for tree in trees:
+                    call(tree, f)
+                run = time.time() - start
+                gc.enable()
+                seconds = min(run, seconds or run)
+            per_node[name][version + '_ns'] = 1e9 * seconds / nodes
+            if version == 'walker':
+                total += seconds
+    # deeper than the recursion limit: only the walker gets through
+    deep = right_branching(sys.getrecursionlimit() + 100)
+    try:
+        recursive_spans(deep, 1, set())
+        recursive_deep = True
+    except RuntimeError:
+        recursive_deep = False
+    return total, nodes, {'per_node': per_node,
+                          'deep_tree': {'words': sys.getrecursionlimit() + 100,
+                                        'recursive': recursive_deep,
+                                        'walker': eval_parser.convert_to_spans(
+                                            deep, 1, set()) > 0}}
+
+TASKS = [
+    ('parse_corpus', task_parse_corpus),
+    ('parse_by_length', task_parse_by_length),
+    ('count_cfg_freq', task_count),
+    ('edit_training_file', task_rare),
+    ('eval_parser', task_eval),
+    ('tree_walk', task_tree_walk),
+]
+
+def run_child(task, args, conn):
+    seconds, items, extra = task(args)
+    result = {'seconds': seconds, 'items': items,
+              'items_per_second': items / seconds if seconds else None,
+              # kilobytes on linux
+              'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    result.update(extra)
+    conn.send(result)
+    conn.close()
+
+def run_task(task, args):
+    """
+    run a task in a fresh process, so its peak RSS is its own
+    :return: the result of the fastest of args.repeat runs
+    """
+    best = None
+    for k in range(args.repeat):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        child = multiprocessing.Process(target=run_child, args=(task, args, sender))
+        child.start()
+        result = receiver.recv()
+        child.join()
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(args):
+    fd, args.prediction_file = tempfile.mkstemp(suffix='.prediction')
+    os.close(fd)
+    results = {'revision': git_revision(), 'python': platform.python_version(),
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'engine': args.engine, 'workers': args.workers, 'tasks': {}}
+    try:
+        for name, task in TASKS:
+            if args.tasks and name not in args.tasks:
+                continue
+            results['tasks'][name] = run_task(task, args)
+            sys.stderr.write("%s: %.3f s\n" % (name, results['tasks'][name]['seconds']))
+    finally:
+        os.remove(args.prediction_file)
+    out = args.output and open(args.output, 'w') or sys.stdout
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the parsing tools.")
+    parser.add_argument('--train-file', default=os.path.join(HERE, 'parse_train.dat'))
+    parser.add_argument('--dev-file', default=os.path.join(HERE, 'parse_dev.dat'))
+    parser.add_argument('--key-file', default=os.path.join(HERE, 'parse_dev.key'))
+    parser.add_argument('--engine', choices=['cky', 'astar', 'pi', 'coarse-to-fine'],
+                        default='cky')
+    parser.add_argument('--grammar', default='cfg_rare.pcfg')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--bucket', type=int, default=5,
+                        help="width of the sentence length buckets")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs per task, the fastest one is reported")
+    parser.add_argument('--tasks', nargs='+', choices=[name for name, task in TASKS],
+                        help="only run these tasks")
+    parser.add_argument('--output', default=None, help="json file, stdout if not given")
+    main(parser.parse_args())
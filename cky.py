@@ -0,0 +1,676 @@
+"""
+Bottom-up CKY engine over an integer-indexed Grammar (see pcfg.py)
+
+Every span (i, j) is filled at once: the scores of all split points
+are stacked into matrices and every binary rule is scored against them
+with a few NumPy operations, instead of recursing through pi() one
+(i, j, X) at a time.
+"""
+
+import sys
+import json
+import time
+import numpy as np
+from collections import OrderedDict
+
+# one chart entry: pi(i, j, x) and its backpointer (argmax s, index of
+# the binary rule X -> Y1 Y2; -1 for the words of span-1 cells)
+ENTRY = np.dtype([('x', np.int32), ('score', np.float64),
+                  ('split', np.int32), ('rule', np.int32)])
+
+EMPTY_CELL = np.zeros(0, dtype=ENTRY)
+
+class Chart(object):
+    """
+    Viterbi chart of a sentence of length n.
+    only entries with pi(i, j, X) > 0 are stored: cells[(i, j)] is an
+    array of ENTRY sorted by X, so memory grows with the number of live
+    items, not with the number of nonterminals times the number of spans.
+    """
+    def __init__(self, n):
+        self.n = n
+        self.cells = {}
+        self.pruned = 0 # number of nonzero entries removed by pruning
+        self.cache_hits = 0 # cells taken from a SpanCache
+        self.cache_misses = 0
+
+    def cell(self, i, j):
+        return self.cells.get((i, j), EMPTY_CELL)
+
+    def entry(self, i, j, x):
+        """
+        :return: the ENTRY of X over (i, j), None if pi(i, j, X) = 0
+        """
+        cell = self.cell(i, j)
+        k = np.searchsorted(cell['x'], x)
+        if k < len(cell) and cell['x'][k] == x:
+            return cell[k]
+        return None
+
+    def n_items(self):
+        return sum(len(cell) for cell in self.cells.itervalues())
+
+
+def new_stats():
+    """
+    :return: zeroed counters and phase timers, filled by parse and
+            the parsers built on it when passed as their stats argument
+    """
+    return {'cells': 0, 'rule_applications': 0, 'items': 0,
+            'lexical_seconds': 0.0, 'span_seconds': 0.0, 'tree_seconds': 0.0}
+
+def lexical_cell(word, grammar):
+    """
+    :return: the cell of a span-1 word, pi(i, i, X) = q(X -> word)
+    """
+    if word not in grammar.lexicon:
+        return EMPTY_CELL
+    tags, probs = grammar.lexicon[word]
+    order = np.argsort(tags)
+    cell = np.zeros(len(tags), dtype=ENTRY)
+    cell['x'] = tags[order]
+    cell['score'] = probs[order]
+    cell['split'] = -1
+    cell['rule'] = -1
+    return cell
+
+def fill_span(i, j, chart, grammar, stats=None):
+    """
+    compute pi(i, j, X) for every X at once
+    :param i: start index
+    :param j: end index, all spans shorter than j - i + 1 must be filled
+    :param stats: optional new_stats() counters, the spans filled and the
+            rules scored at each of their split points are added to it
+    :return: the new cell, holding the entries with pi > 0
+    """
+    # dense pi(i, s, Y1) and pi(s + 1, j, Y2) for s in [i, j), only
+    # alive while the span is being filled
+    left = np.zeros((j - i, grammar.n_symbols))
+    right = np.zeros((j - i, grammar.n_symbols))
+    for k, s in enumerate(range(i, j)):
+        cell = chart.cell(i, s)
+        left[k, cell['x']] = cell['score']
+        cell = chart.cell(s + 1, j)
+        right[k, cell['x']] = cell['score']
+
+    # only rules whose children are nonzero at some split can score above
+    # zero; this is where pruned or unreachable entries save work
+    active = np.flatnonzero(left.any(axis=0)[grammar.rule_left]
+                            & right.any(axis=0)[grammar.rule_right])
+    if stats is not None:
+        stats['cells'] += 1
+        stats['rule_applications'] += len(active) * (j - i)
+    if len(active) == 0:
+        return EMPTY_CELL
+    lhs = grammar.rule_lhs[active]
+    # shape [len(active), (j - i)], same product order as pi()
+    sub_pi_matrix = grammar.rule_prob[active, None] \
+                    * left[:, grammar.rule_left[active]].T \
+                    * right[:, grammar.rule_right[active]].T
+    best_s = np.argmax(sub_pi_matrix, axis=1)
+    best = sub_pi_matrix[np.arange(len(active)), best_s]
+
+    # best rule of every left-hand side; the first one wins a tie,
+    # as np.argmax over the flatten matrix does in pi()
+    change = np.ones(len(active), dtype=bool)
+    change[1:] = lhs[1:] != lhs[:-1]
+    group_start = np.flatnonzero(change)
+    group_max = np.maximum.reduceat(best, group_start)
+    hit = best == np.repeat(group_max, np.diff(np.append(group_start, len(active))))
+    first = np.minimum.reduceat(np.where(hit, np.arange(len(active)), len(active)),
+                                group_start)
+    live = group_max > 0.0
+    x = lhs[group_start][live]
+    first = first[live]
+    order = np.argsort(x)
+    cell = np.zeros(len(x), dtype=ENTRY)
+    cell['x'] = x[order]
+    cell['score'] = group_max[live][order]
+    cell['split'] = i + best_s[first][order]
+    cell['rule'] = active[first][order]
+    return cell
+
+def prune_cell(cell, beam=None, threshold=None, log=False):
+    """
+    remove the entries of a cell that are unlikely to be on the best parse
+    :param beam: keep at most this many entries
+    :param threshold: remove entries below threshold * the best entry
+    :param log: the scores of the cell are log probabilities
+    :return: (the pruned cell, number of entries removed)
+    """
+    if len(cell) == 0 or not (beam or threshold):
+        return cell, 0
+    keep = np.ones(len(cell), dtype=bool)
+    if threshold and log:
+        keep &= cell['score'] >= np.log(threshold) + cell['score'].max()
+    elif threshold:
+        keep &= cell['score'] >= threshold * cell['score'].max()
+    if beam and len(cell) > beam:
+        # stable sort, so among equal scores the lowest X survives
+        order = np.argsort(-cell['score'], kind='mergesort')
+        keep[order[beam:]] = False
+    return cell[keep], len(cell) - np.count_nonzero(keep)
+
+class SpanCache(object):
+    """
+    finished cells shared across sentences, keyed by the tokens of their
+    span. a cell only depends on the words it covers, so after '_RARE_'
+    substitution recurring spans ("the _RARE_", punctuation runs, ...) are
+    filled once. least recently used cells are evicted to stay under
+    max_bytes. a cache must only be used with one grammar and one set of
+    pruning options.
+    """
+    # rough per-entry overhead of the key tuple and the dictionaries
+    OVERHEAD = 200
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.cells = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: (cell with splits relative to the span start, pruned),
+                None on a miss
+        """
+        value = self.cells.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.cells[key] = value # most recently used
+        self.hits += 1
+        return value
+
+    def put(self, key, cell, pruned):
+        size = self.size(key, cell)
+        if size > self.max_bytes:
+            return
+        self.cells[key] = (cell, pruned)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key, (old_cell, old_pruned) = self.cells.popitem(last=False)
+            self.bytes -= self.size(old_key, old_cell)
+
+    def size(self, key, cell):
+        return cell.nbytes + sys.getsizeof(key) + self.OVERHEAD
+
+def cached_span(i, j, sentence, chart, grammar, cache, beam, threshold, stats=None):
+    """
+    fill and prune cell (i, j) unless the cache has it
+    :return: (cell, pruned)
+    """
+    key = tuple(sentence[i:j + 1])
+    value = cache.get(key)
+    if value is not None:
+        chart.cache_hits += 1
+        cell, pruned = value
+        cell = cell.copy()
+        cell['split'] += i
+        return cell, pruned
+    chart.cache_misses += 1
+    cell, pruned = prune_cell(fill_span(i, j, chart, grammar, stats), beam, threshold)
+    relative = cell.copy()
+    relative['split'] -= i
+    cache.put(key, relative, pruned)
+    return cell, pruned
+
+def parse(sentence, grammar, beam=None, threshold=None, cache=None, stats=None):
+    """
+    fill the chart of a sentence bottom-up
+    :param sentence: a sentence to parse, in format of list, with a
+            place holder at index 0 and rare words already replaced
+    :param grammar: an indexed Grammar
+    :param beam: optional per-cell beam width, see prune_cell; cells of
+            span 1 are not pruned
+    :param threshold: optional per-cell probability threshold relative to
+            the best entry of the cell, see prune_cell
+    :param cache: optional SpanCache for the cells of spans longer than 1
+    :param stats: optional new_stats() counters and timers; when None
+            nothing is measured
+    :return: the filled Chart
+    """
+    n = len(sentence) - 1
+    chart = Chart(n)
+    if stats is not None:
+        start = time.time()
+    for width in range(0, n):
+        for i in range(1, n - width + 1):
+            if width == 0:
+                # q(X -> w) is P(w | X), it does not rank the tags of a
+                # word: open-class tags would be pruned first
+                cell, pruned = lexical_cell(sentence[i], grammar), 0
+            elif cache is not None:
+                cell, pruned = cached_span(i, i + width, sentence, chart, grammar,
+                                           cache, beam, threshold, stats)
+            else:
+                cell, pruned = prune_cell(fill_span(i, i + width, chart, grammar,
+                                                    stats),
+                                          beam, threshold)
+            chart.pruned += pruned
+            if len(cell):
+                chart.cells[(i, i + width)] = cell
+        if stats is not None and width == 0:
+            now = time.time()
+            stats['lexical_seconds'] += now - start
+            start = now
+    if stats is not None:
+        stats['span_seconds'] += time.time() - start
+        stats['items'] += chart.n_items()
+    return chart
+
+def best_root(chart, grammar, root='S'):
+    """
+    :return: index of the nonterminal spanning the whole sentence, 'S'
+            unless the sentence cannot be parsed as one, None if it
+            cannot be parsed at all
+    """
+    x = grammar.index[root]
+    if chart.entry(1, chart.n, x) is None:
+        cell = chart.cell(1, chart.n)
+        if not len(cell):
+            return None
+        x = int(cell['x'][np.argmax(cell['score'])])
+    return x
+
+def tree_json(sentence, x, chart, grammar):
+    """
+    write the tree of X over the whole sentence as json straight from the
+    backpointers, without building nested lists first:
+    [X, word] for a word, [X, left, right] above it, the format read by
+    eval_parser.py and pretty_print_tree.py
+    :param x: index of the nonterminal at the root
+    :return: the json string
+    """
+    symbols = grammar.json_symbols
+    pieces = []
+    # spans (i, j, x) still to write and the text closing their parents
+    stack = [(1, chart.n, x)]
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            pieces.append(item)
+            continue
+        i, j, x = item
+        if i == j:
+            pieces.append('[%s, %s]' % (symbols[x], json.dumps(sentence[i])))
+            continue
+        entry = chart.entry(i, j, x)
+        s = int(entry['split'])
+        r = entry['rule']
+        pieces.append('[%s, ' % symbols[x])
+        stack.append(']')
+        stack.append((s + 1, j, int(grammar.rule_right[r])))
+        stack.append(', ')
+        stack.append((i, s, int(grammar.rule_left[r])))
+    return ''.join(pieces)
+
+def parse_chart(sentence, grammar, **options):
+    """
+    :param options: pruning, cache and stats options passed to parse; a
+            sentence left without any parse by pruning is parsed again
+            without it
+    :return: (the Chart of a sentence, index of the nonterminal at the
+            root of its Viterbi tree)
+    """
+    chart = parse(sentence, grammar, **options)
+    if (options.get('beam') or options.get('threshold')) \
+            and not len(chart.cell(1, chart.n)):
+        # pruning removed every parse, fall back to the exhaustive chart
+        pruned = chart.pruned
+        chart = parse(sentence, grammar, stats=options.get('stats'))
+        chart.pruned = pruned
+    return chart, best_root(chart, grammar)
+
+class DenseChart(object):
+    """
+    the chart of one sentence of a batch_parse: dense score, split and
+    rule arrays indexed [i, j, X], read like a Chart by best_root and
+    tree_json
+    """
+    def __init__(self, n, score, split, rule, pruned=0):
+        self.n = n
+        self.score_ = score
+        self.split = split
+        self.rule = rule
+        self.pruned = pruned
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def entry(self, i, j, x):
+        score = self.score_[i, j, x]
+        if score <= 0.0:
+            return None
+        return {'x': x, 'score': score, 'split': self.split[i, j, x],
+                'rule': self.rule[i, j, x]}
+
+    def cell(self, i, j):
+        x = np.flatnonzero(self.score_[i, j])
+        cell = np.zeros(len(x), dtype=ENTRY)
+        cell['x'] = x
+        cell['score'] = self.score_[i, j, x]
+        cell['split'] = self.split[i, j, x]
+        cell['rule'] = self.rule[i, j, x]
+        return cell
+
+    def n_items(self):
+        return np.count_nonzero(self.score_)
+
+def batch_bytes(n, grammar):
+    """
+    :return: rough peak memory of one sentence of length n in a batch: its
+            dense chart, and the rule-by-split matrices of its spans of the
+            widest width
+    """
+    return (n + 1) * (n + 1) * grammar.n_symbols * (8 + 4 + 4) \
+           + 3 * ((n + 1) // 2) ** 2 * grammar.n_rules * 8
+
+def prune_dense(cells, beam=None, threshold=None):
+    """
+    prune_cell for many cells at once
+    :param cells: [cell, X] scores, pruned entries are set to 0
+    :return: number of nonzero entries removed from every cell
+    """
+    if not (beam or threshold):
+        return 0
+    keep = np.ones(cells.shape, dtype=bool)
+    if threshold:
+        keep &= cells >= threshold * cells.max(axis=1)[:, None]
+    if beam and cells.shape[1] > beam:
+        # stable sort, so among equal scores the lowest X survives
+        order = np.argsort(-cells, axis=1, kind='mergesort')
+        rank = np.empty_like(order)
+        rank[np.arange(len(cells))[:, None], order] = np.arange(cells.shape[1])
+        keep &= rank < beam
+    removed = (cells > 0.0) & ~keep
+    cells[removed] = 0.0
+    return np.count_nonzero(removed, axis=1)
+
+def batch_parse(sentences, grammar, beam=None, threshold=None, stats=None,
+                allowed=None):
+    """
+    fill the charts of sentences of the same length at once, all the
+    spans of a width together: the rules of every span whose children are
+    nonzero are gathered in one list, and the array operations of
+    fill_span run over it
+    :param sentences: sentences as for parse, all of the same length n
+    :param beam: see prune_cell
+    :param threshold: see prune_cell
+    :param stats: optional new_stats() counters and timers of the batch
+    :param allowed: optional [batch, i, j, X] boolean array, only these
+            items are scored: spans with none of them are skipped, and
+            only the rules of the allowed left-hand sides of a span are
+            gathered (see coarse_to_fine.py)
+    :return: a DenseChart for every sentence, with the same Viterbi
+            entries as parse would find
+    """
+    b = len(sentences)
+    n = len(sentences[0]) - 1
+    shape = (b, n + 1, n + 1, grammar.n_symbols)
+    score = np.zeros(shape)
+    split = np.zeros(shape, dtype=np.int32)
+    rule = np.zeros(shape, dtype=np.int32)
+    pruned = np.zeros(b, dtype=np.int64)
+    if stats is not None:
+        start = time.time()
+    for k, sentence in enumerate(sentences):
+        for i in range(1, n + 1):
+            if sentence[i] in grammar.lexicon:
+                tags, probs = grammar.lexicon[sentence[i]]
+                score[k, i, i, tags] = probs
+    # span-1 cells are not pruned, see parse
+    if allowed is not None:
+        for i in range(1, n + 1):
+            score[:, i, i] *= allowed[:, i, i]
+    if stats is not None:
+        now = time.time()
+        stats['lexical_seconds'] += now - start
+        start = now
+    for width in range(1, n):
+        # every span (i, j) of this width at once
+        starts = np.arange(1, n - width + 1)
+        if allowed is not None:
+            cells_allowed = allowed[:, starts, starts + width]
+            live = cells_allowed.any(axis=(0, 2))
+            if not live.any():
+                continue
+            starts = starts[live]
+            cells_allowed = cells_allowed[:, live]
+        ends = starts + width
+        k = np.arange(width)
+        splits = starts[:, None] + k
+        # the rules whose children are nonzero at some split of a span,
+        # [batch, span, rule]; only these are scored
+        alive = score[:, starts[:, None], splits].any(axis=2)[..., grammar.rule_left] \
+                & score[:, splits + 1, ends[:, None]].any(axis=2)[..., grammar.rule_right]
+        if allowed is not None:
+            alive &= cells_allowed[..., grammar.rule_lhs]
+        # (sentence, span, rule) of every scored rule, by sentence, span
+        # and left-hand side as the rules are sorted by it
+        s, span, r = np.nonzero(alive)
+        if stats is not None:
+            stats['cells'] += b * len(starts)
+            stats['rule_applications'] += len(r) * width
+        if len(r) == 0:
+            continue
+        i = starts[span][:, None]
+        j = ends[span][:, None]
+        # pi(i, s, Y1) and pi(s + 1, j, Y2) by their flat index in score,
+        # which np.take gathers faster than an index tuple
+        cells = s[:, None] * (n + 1)
+        left = ((cells + i) * (n + 1) + i + k) * grammar.n_symbols \
+               + grammar.rule_left[r][:, None]
+        right = ((cells + i + k + 1) * (n + 1) + j) * grammar.n_symbols \
+                + grammar.rule_right[r][:, None]
+        # shape [len(r), width], same product order as pi()
+        sub_pi_matrix = grammar.rule_prob[r][:, None] \
+                        * score.take(left) * score.take(right)
+        best_s = np.argmax(sub_pi_matrix, axis=1)
+        best = sub_pi_matrix[np.arange(len(r)), best_s]
+        # first best rule of every left-hand side of a span, as in fill_span
+        lhs = grammar.rule_lhs[r]
+        change = np.ones(len(r), dtype=bool)
+        change[1:] = (lhs[1:] != lhs[:-1]) | (span[1:] != span[:-1]) | (s[1:] != s[:-1])
+        group_start = np.flatnonzero(change)
+        group_max = np.maximum.reduceat(best, group_start)
+        hit = best == np.repeat(group_max, np.diff(np.append(group_start, len(r))))
+        first = np.minimum.reduceat(np.where(hit, np.arange(len(r)), len(r)), group_start)
+        s, x, i, j = s[first], lhs[first], i[first, 0], j[first, 0]
+        score[s, i, j, x] = group_max
+        split[s, i, j, x] = i + best_s[first]
+        rule[s, i, j, x] = r[first]
+        if beam or threshold:
+            cells = score[:, starts, ends].reshape(-1, grammar.n_symbols)
+            pruned += prune_dense(cells, beam, threshold).reshape(b, -1).sum(axis=1)
+            score[:, starts, ends] = cells.reshape(b, len(starts), -1)
+    if stats is not None:
+        stats['span_seconds'] += time.time() - start
+        stats['items'] += np.count_nonzero(score)
+    return [DenseChart(n, score[k], split[k], rule[k], int(pruned[k])) for k in range(b)]
+
+def batch_parse_charts(sentences, grammar, beam=None, threshold=None, stats=None):
+    """
+    batch_parse, with parse_chart's fallback for the sentences that
+    pruning left without any parse
+    :return: [(chart, index of the root nonterminal)] in input order
+    """
+    charts = batch_parse(sentences, grammar, beam, threshold, stats)
+    results = []
+    for sentence, chart in zip(sentences, charts):
+        if (beam or threshold) and not len(chart.cell(1, chart.n)):
+            pruned = chart.pruned
+            chart = parse(sentence, grammar, stats=stats)
+            chart.pruned = pruned
+        results.append((chart, best_root(chart, grammar)))
+    return results
+
+# compact chart entry of the memory-bounded mode: the score is a log
+# probability, which does not underflow on long sentences as products do
+COMPACT_ENTRY = np.dtype([('x', np.int16), ('score', np.float32),
+                          ('split', np.int16), ('rule', np.int32)])
+
+# rough memory of a cell besides its entries: the array object, its key
+# in Chart.cells and the dictionary slot
+CELL_OVERHEAD = 200
+
+def chart_bytes(n, grammar, width=None):
+    """
+    :return: most memory the compact chart of a sentence of length n can
+            take with at most width entries per cell of a span longer than
+            1 (no limit if None; span-1 cells are never pruned), plus the
+            dense matrices used to fill its longest span
+    """
+    width = min(width or grammar.n_symbols, grammar.n_symbols)
+    cells = n * (n - 1) // 2
+    return cells * (width * COMPACT_ENTRY.itemsize + CELL_OVERHEAD) \
+           + n * (grammar.n_symbols * COMPACT_ENTRY.itemsize + CELL_OVERHEAD) \
+           + 2 * n * grammar.n_symbols * 8 + 3 * n * grammar.n_rules * 8
+
+def max_beam(n, grammar, max_bytes):
+    """
+    :return: the widest per-cell beam that keeps chart_bytes within
+            max_bytes, 0 if even a beam of 1 does not fit
+    """
+    cells = n * (n - 1) // 2
+    fixed = chart_bytes(n, grammar, 1) - cells * COMPACT_ENTRY.itemsize
+    if cells == 0:
+        return fixed <= max_bytes and grammar.n_symbols or 0
+    return max(0, min(grammar.n_symbols,
+                      (max_bytes - fixed) // (cells * COMPACT_ENTRY.itemsize)))
+
+def compact_lexical_cell(word, grammar):
+    """
+    lexical_cell with log probabilities, as COMPACT_ENTRY
+    """
+    if word not in grammar.lexicon:
+        return np.zeros(0, dtype=COMPACT_ENTRY)
+    tags, probs = grammar.lexicon[word]
+    order = np.argsort(tags)
+    cell = np.zeros(len(tags), dtype=COMPACT_ENTRY)
+    cell['x'] = tags[order]
+    cell['score'] = np.log(probs[order])
+    cell['split'] = -1
+    cell['rule'] = -1
+    return cell
+
+def fill_compact_span(i, j, chart, grammar, stats=None):
+    """
+    fill_span over log probabilities, returning COMPACT_ENTRY cells.
+    scores are added in float64 and stored rounded to float32, so near
+    ties can be broken differently than by fill_span
+    """
+    left = np.full((j - i, grammar.n_symbols), -np.inf)
+    right = np.full((j - i, grammar.n_symbols), -np.inf)
+    for k, s in enumerate(range(i, j)):
+        cell = chart.cell(i, s)
+        left[k, cell['x']] = cell['score']
+        cell = chart.cell(s + 1, j)
+        right[k, cell['x']] = cell['score']
+
+    live_left = np.isfinite(left).any(axis=0)
+    live_right = np.isfinite(right).any(axis=0)
+    active = np.flatnonzero(live_left[grammar.rule_left] & live_right[grammar.rule_right])
+    if stats is not None:
+        stats['cells'] += 1
+        stats['rule_applications'] += len(active) * (j - i)
+    if len(active) == 0:
+        return np.zeros(0, dtype=COMPACT_ENTRY)
+    lhs = grammar.rule_lhs[active]
+    sub_pi_matrix = grammar.rule_log_prob[active, None] \
+                    + left[:, grammar.rule_left[active]].T \
+                    + right[:, grammar.rule_right[active]].T
+    best_s = np.argmax(sub_pi_matrix, axis=1)
+    best = sub_pi_matrix[np.arange(len(active)), best_s]
+
+    change = np.ones(len(active), dtype=bool)
+    change[1:] = lhs[1:] != lhs[:-1]
+    group_start = np.flatnonzero(change)
+    group_max = np.maximum.reduceat(best, group_start)
+    hit = best == np.repeat(group_max, np.diff(np.append(group_start, len(active))))
+    first = np.minimum.reduceat(np.where(hit, np.arange(len(active)), len(active)),
+                                group_start)
+    live = np.isfinite(group_max)
+    x = lhs[group_start][live]
+    first = first[live]
+    order = np.argsort(x)
+    cell = np.zeros(len(x), dtype=COMPACT_ENTRY)
+    cell['x'] = x[order]
+    cell['score'] = group_max[live][order]
+    cell['split'] = i + best_s[first][order]
+    cell['rule'] = active[first][order]
+    return cell
+
+def bounded_parse_chart(sentence, grammar, max_bytes, beam=None, threshold=None,
+                        stats=None, cache=None):
+    """
+    parse a sentence in a compact log-probability chart that stays within
+    a memory budget: if the full chart may not fit, every cell is pruned
+    to the widest beam that does (see max_beam)
+    :param max_bytes: memory budget of the chart, see chart_bytes
+    :param beam: optional narrower beam, see prune_cell
+    :param threshold: see prune_cell
+    :param cache: ignored, the span cache holds uncompact cells
+    :return: (Chart of COMPACT_ENTRY cells, index of the root nonterminal),
+            the root is None if the sentence does not fit even with a
+            beam of 1 or has no parse left; chart.fallback is
+            None, 'beam' when the budget forced a beam, or 'default'
+    """
+    n = len(sentence) - 1
+    chart = Chart(n)
+    chart.fallback = None
+    if chart_bytes(n, grammar) > max_bytes:
+        width = max_beam(n, grammar, max_bytes)
+        if width == 0:
+            chart.fallback = 'default'
+            return chart, None
+        chart.fallback = 'beam'
+        beam = min(beam or width, width)
+    if stats is not None:
+        start = time.time()
+    for width in range(0, n):
+        for i in range(1, n - width + 1):
+            if width == 0:
+                # not pruned, see parse
+                cell = compact_lexical_cell(sentence[i], grammar)
+            else:
+                cell, pruned = prune_cell(fill_compact_span(i, i + width, chart,
+                                                            grammar, stats),
+                                          beam, threshold, log=True)
+                chart.pruned += pruned
+            if len(cell):
+                chart.cells[(i, i + width)] = cell
+        if stats is not None and width == 0:
+            now = time.time()
+            stats['lexical_seconds'] += now - start
+            start = now
+    if stats is not None:
+        stats['span_seconds'] += time.time() - start
+        stats['items'] += chart.n_items()
+    if not len(chart.cell(1, n)):
+        chart.fallback = 'default'
+        return chart, None
+    return chart, best_root(chart, grammar)
+
+def right_branching_json(sentence, grammar, root='S'):
+    """
+    the default tree of a sentence that has no parse, or cannot be parsed
+    within its memory budget: every word under the tag it was seen with
+    most often in training (see pcfg.Grammar.best_tag), and a chain of
+    root nodes from left to right, [S, [tag1, w1], [S, [tag2, w2], ...]]
+    :return: the json string, in the format of tree_json
+    """
+    n = len(sentence) - 1
+    symbols = grammar.json_symbols
+    pieces = []
+    for i in range(1, n + 1):
+        if i < n:
+            pieces.append('[%s, ' % symbols[grammar.index[root]])
+        tag = grammar.best_tag(sentence[i])
+        if tag is None:
+            tag = grammar.index[root]
+        pieces.append('[%s, %s]' % (symbols[tag], json.dumps(sentence[i])))
+        if i < n:
+            pieces.append(', ')
+    pieces.append(']' * (n - 1))
+    return ''.join(pieces)
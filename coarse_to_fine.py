@@ -0,0 +1,295 @@
+"""
+Coarse-to-fine parsing with the vertically markovized grammar
+
+the fine grammar is trained on parse_train_vert.dat, where nonterminals
+carry their parent (NP^<S>), and has several refinements of every coarse
+nonterminal of cfg_rare.counts. a sentence is first parsed with the
+coarse grammar by inside-outside: the posterior of every item (i, j, X)
+is the probability mass of the trees that use it. CKY then runs on the
+fine grammar, scoring a refinement of X over (i, j) only if the
+posterior of (i, j, X) is at least the threshold. fine symbols map to
+coarse ones by eval_parser.simplify_non_terminal.
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+import cky
+import pcfg
+import train_pipeline
+from eval_parser import simplify_non_terminal
+from vocab import file_checksum
+
+TREE_FILE = 'parse_train_vert.dat'
+COUNTS_FILE = 'cfg_vert.counts'
+RARE_COUNTS_FILE = 'cfg_vert_rare.counts'
+GRAMMAR_FILE = 'cfg_vert_rare.pcfg'
+SOURCES_FILE = 'cfg_vert.sources'
+THRESHOLD = 1e-4
+
+def counts_sources(tree_file, threshold, signatures):
+    """
+    :return: what the fine counts files depend on, stored in SOURCES_FILE
+    """
+    return {tree_file: file_checksum(tree_file), 'rare threshold': threshold,
+            'signatures': signatures}
+
+def open_fine_grammar(threshold=pcfg.RARE_THRESHOLD, signatures=False,
+                      tree_file=TREE_FILE, counts_file=COUNTS_FILE,
+                      rare_counts_file=RARE_COUNTS_FILE, grammar_file=GRAMMAR_FILE,
+                      sources_file=SOURCES_FILE):
+    """
+    load the compiled markovized grammar, counting tree_file first (see
+    train_pipeline.py) if its counts files are missing or were made from
+    another tree file, rare threshold or signatures setting
+    :param threshold: rare word threshold, as for the coarse grammar
+    :param signatures: rare words are replaced by their signature class
+    :param sources_file: json file of the counts_sources of the counts files
+    :return: (grammar, frequent_words), see pcfg.open_grammar
+    """
+    sources = counts_sources(tree_file, threshold, signatures)
+    try:
+        with open(sources_file) as f:
+            stale = json.load(f) != sources
+    except (IOError, ValueError):
+        stale = True
+    if stale or not (os.path.exists(counts_file) and os.path.exists(rare_counts_file)):
+        train_pipeline.main(tree_file, counts_file, rare_counts_file, threshold,
+                            signatures=signatures)
+        with open(sources_file, 'w') as f:
+            json.dump(sources, f, sort_keys=True)
+    return pcfg.open_grammar(rare_counts_file, counts_file, grammar_file, threshold)
+
+def projection(coarse, fine):
+    """
+    :return: the index in coarse of the coarse symbol of every symbol of
+            fine, -1 if coarse does not have it
+    """
+    return np.array([coarse.index.get(simplify_non_terminal(x), -1)
+                     for x in fine.symbols], dtype=np.int32)
+
+def rule_matrix(grammar, heads, lefts, rights):
+    """
+    :param heads: left-hand sides, lefts and rights the children taken
+            into account, arrays of symbols
+    :return: (pairs, matrix): the pairs of children of the rules over
+            lefts and rights, as the position of Y1 in lefts times
+            len(rights) plus the one of Y2 in rights, and the [X, pair]
+            sums of q(X -> Y1 Y2) over the rules of every pair, X by its
+            position in heads
+    """
+    position = np.full((3, grammar.n_symbols), -1, dtype=np.int64)
+    for k, symbols in enumerate((heads, lefts, rights)):
+        position[k, symbols] = np.arange(len(symbols))
+    x = position[0, grammar.rule_lhs]
+    y1 = position[1, grammar.rule_left]
+    y2 = position[2, grammar.rule_right]
+    rules = (x >= 0) & (y1 >= 0) & (y2 >= 0)
+    pairs, rule_pair = np.unique(y1[rules] * len(rights) + y2[rules], return_inverse=True)
+    matrix = np.zeros((len(heads), len(pairs)))
+    np.add.at(matrix, (x[rules], rule_pair), grammar.rule_prob[rules])
+    return pairs, matrix
+
+def sum_splits(left, right, rules):
+    """
+    :param left: [s, i, split, Y1] inside scores of the left children
+    :param right: [s, i, split, Y2] inside scores of the right children
+    :param rules: rule_matrix of Y1 and Y2
+    :return: [s, i, X] inside scores of the parents
+    """
+    pairs, matrix = rules
+    # sums over the splits of left * right, [s, i, Y1, Y2] flattened
+    children = np.matmul(left.transpose(0, 1, 3, 2), right)
+    return np.matmul(children.reshape(left.shape[:2] + (-1,))[..., pairs], matrix.T)
+
+def spread_splits(outside, left, right, rules):
+    """
+    :param outside: [s, i, X] outside scores of the parents
+    :return: [s, i, split, Y1] and [s, i, split, Y2] outside scores of
+            the left and right children, see sum_splits
+    """
+    pairs, matrix = rules
+    # outside score times q(X -> Y1 Y2), summed over the X, [s, i, Y1, Y2]
+    parents = np.zeros(outside.shape[:2] + (left.shape[3] * right.shape[3],))
+    parents[..., pairs] = np.matmul(outside, matrix)
+    parents = parents.reshape(outside.shape[:2] + (left.shape[3], right.shape[3]))
+    return np.matmul(right, parents.transpose(0, 1, 3, 2)), np.matmul(left, parents)
+
+class InsideOutside(object):
+    """
+    sums over all the trees of sentences of the same length, all the
+    spans of a width at once. a span of one word only holds tags, and a
+    longer one only left-hand sides of rules (phrases): the sums over the
+    splits of a span are matrix products over those symbols alone, the
+    first and last split apart since they have a word as a child
+    """
+    def __init__(self, grammar, root='S'):
+        g = self.grammar = grammar
+        self.phrases = np.unique(g.rule_lhs)
+        self.tags = np.unique(np.concatenate([tags for tags, probs in g.lexicon.itervalues()]))
+        self.tag_position = np.zeros(g.n_symbols, dtype=np.int64)
+        self.tag_position[self.tags] = np.arange(len(self.tags))
+        # position of the root among the phrases
+        self.root = None
+        x = g.index.get(root)
+        if x is not None and x in self.phrases:
+            self.root = np.searchsorted(self.phrases, x)
+        # rules by the kind of their children, tags (t) or phrases (p)
+        self.tt = rule_matrix(g, self.phrases, self.tags, self.tags)
+        self.tp = rule_matrix(g, self.phrases, self.tags, self.phrases)
+        self.pt = rule_matrix(g, self.phrases, self.phrases, self.tags)
+        self.pp = rule_matrix(g, self.phrases, self.phrases, self.phrases)
+
+    def __call__(self, sentences):
+        """
+        the scores of every word are divided by the one of its best tag:
+        every tree holds each word once, so posteriors do not change, and
+        long sentences do not underflow
+        :return: (inside, outside), [sentence, i, j, X] arrays; the outside
+                score of a whole sentence is 1 for S, or for every X if
+                there is no S over it
+        """
+        g = self.grammar
+        b = len(sentences)
+        n = len(sentences[0]) - 1
+        # scores of the tags of every word, [s, i, tag], and of the
+        # phrases over every longer span, [s, i, j, phrase]
+        word_in = np.zeros((b, n + 2, len(self.tags)))
+        phrase_in = np.zeros((b, n + 2, n + 2, len(self.phrases)))
+        word_out = np.zeros(word_in.shape)
+        phrase_out = np.zeros(phrase_in.shape)
+        for s, sentence in enumerate(sentences):
+            for i in range(1, n + 1):
+                if sentence[i] in g.lexicon:
+                    tags, probs = g.lexicon[sentence[i]]
+                    word_in[s, i, self.tag_position[tags]] = probs / probs.max()
+
+        # children as (inside, outside, index of their [s, i, split, Y]
+        # scores)
+        def words(i):
+            return word_in, word_out, (slice(None), i)
+
+        def spans(i, j):
+            return phrase_in, phrase_out, (slice(None), i, j)
+
+        def children(width):
+            # the splits of the spans (i, j) of a width: the first one has
+            # the word i on the left, the last one the word j on the
+            # right; every pair of children comes with the rules of their
+            # two kinds
+            starts = np.arange(1, n - width + 1)[:, None]
+            ends = starts + width
+            if width == 1:
+                return [(words(starts), words(ends), self.tt)]
+            splits = [(words(starts), spans(starts + 1, ends), self.tp),
+                      (spans(starts, ends - 1), words(ends), self.pt)]
+            if width > 2:
+                middle = starts + np.arange(1, width - 1)
+                splits.append((spans(starts, middle), spans(middle + 1, ends), self.pp))
+            return splits
+
+        for width in range(1, n):
+            starts = np.arange(1, n - width + 1)
+            phrase_in[:, starts, starts + width] = sum(
+                sum_splits(left_in[left], right_in[right], rules)
+                for (left_in, _, left), (right_in, _, right), rules in children(width))
+
+        if n == 1:
+            # the whole sentence is a word
+            word_out[:, 1] = 1.0
+        else:
+            for s in range(b):
+                if self.root is not None and phrase_in[s, 1, n, self.root]:
+                    phrase_out[s, 1, n, self.root] = 1.0
+                else:
+                    phrase_out[s, 1, n] = 1.0
+        for width in range(n - 1, 0, -1):
+            starts = np.arange(1, n - width + 1)
+            for (left_in, left_out, left), (right_in, right_out, right), rules \
+                    in children(width):
+                outside_left, outside_right = spread_splits(
+                    phrase_out[:, starts, starts + width], left_in[left], right_in[right],
+                    rules)
+                left_out[left] += outside_left
+                right_out[right] += outside_right
+
+        inside = np.zeros((b, n + 2, n + 2, g.n_symbols))
+        outside = np.zeros(inside.shape)
+        inside[..., self.phrases] = phrase_in
+        outside[..., self.phrases] = phrase_out
+        words = np.arange(1, n + 1)[:, None]
+        inside[:, words, words, self.tags] = word_in[:, 1:n + 1]
+        outside[:, words, words, self.tags] = word_out[:, 1:n + 1]
+        return inside, outside
+
+def coarse_items(sentences, inside_outside, threshold=THRESHOLD):
+    """
+    :param sentences: sentences of the same length
+    :param inside_outside: InsideOutside of the coarse grammar
+    :return: ([sentence, i, j, X] boolean array of the items whose
+            posterior is at least threshold, number of items of every
+            sentence with a nonzero posterior below it); every item of a
+            sentence without a coarse parse is kept
+    """
+    n = len(sentences[0]) - 1
+    inside, outside = inside_outside(sentences)
+    posterior = inside * outside
+    total = (inside[:, 1, n] * outside[:, 1, n]).sum(axis=1)
+    posterior /= np.where(total > 0.0, total, 1.0)[:, None, None, None]
+    keep = posterior >= threshold
+    keep[total == 0.0] = True
+    pruned = np.count_nonzero((posterior > 0.0) & ~keep, axis=(1, 2, 3))
+    return keep, pruned
+
+def batch_bytes(n, coarse, fine):
+    """
+    :param coarse: the unannotated pcfg.Grammar
+    :param fine: the markovized pcfg.Grammar
+    :return: rough peak memory of one sentence of length n in a batch of
+            parse_charts: the one of cky.batch_parse, the coarse inside,
+            outside and posterior arrays and the items kept
+    """
+    return cky.batch_bytes(n, fine) \
+           + (n + 2) * (n + 2) * (3 * 8 * coarse.n_symbols + fine.n_symbols)
+
+def parse_charts(sentences, coarse, fine, refines, threshold=THRESHOLD, stats=None):
+    """
+    :param sentences: sentences of the same length
+    :param coarse: InsideOutside of the unannotated pcfg.Grammar
+    :param fine: the markovized pcfg.Grammar
+    :param refines: projection(coarse, fine)
+    :param threshold: posterior threshold of the coarse items
+    :param stats: optional cky.new_stats() counters and timers, the coarse
+            pass is counted in span_seconds
+    :return: [(the chart of the fine grammar, index of its root
+            nonterminal or None)] in input order, see cky.batch_parse;
+            chart.pruned is the number of coarse items pruned. a sentence
+            left without a parse is parsed again with the whole fine
+            grammar
+    """
+    if stats is not None:
+        start = time.time()
+    keep, pruned = coarse_items(sentences, coarse, threshold)
+    # fine symbols without a coarse one are never pruned
+    keep = np.concatenate([keep, np.ones(keep.shape[:3] + (1,), dtype=bool)], axis=3)
+    keep = keep[..., refines]
+    if stats is not None:
+        stats['span_seconds'] += time.time() - start
+    charts = cky.batch_parse(sentences, fine, stats=stats, allowed=keep)
+    results = []
+    for sentence, chart, p in zip(sentences, charts, pruned):
+        if not len(chart.cell(1, chart.n)):
+            chart = cky.parse(sentence, fine, stats=stats)
+        chart.pruned = int(p)
+        results.append((chart, cky.best_root(chart, fine)))
+    return results
+
+def parse_chart(sentence, coarse, fine, refines, threshold=THRESHOLD, stats=None):
+    """
+    parse_charts for one sentence
+    :return: (the chart of the fine grammar, index of its root
+            nonterminal or None)
+    """
+    return parse_charts([sentence], coarse, fine, refines, threshold, stats)[0]
@@ -3,27 +3,85 @@
 __author__="Alexander Rush <srush@csail.mit.edu>"
 __date__ ="$Sep 12, 2012"
 
-import sys, json
+import sys, os, json
+import heapq
+from array import array
+import shutil
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from cStringIO import StringIO
+import numpy as np
+
+import treebank
 
 """
 Count rule frequencies in a binarized CFG.
 """
 
 class Counts:
-  def __init__(self):
-    self.unary = {}
-    self.binary = {}
-    self.nonterm = {}
+  def __init__(self, ordered=False):
+    """
+    With ordered=True the counts remember the order in which keys were
+    first seen, so plain() can rebuild the exact dicts (and show() output)
+    of counting the same trees in one go.
+    """
+    d = ordered and OrderedDict or dict
+    self.unary = d()
+    self.binary = d()
+    self.nonterm = d()
+
+  def plain(self):
+    """
+    Counts with plain dicts, filled in the order of this one's keys.
+    """
+    counts = Counts()
+    for mine, plain in ((self.nonterm, counts.nonterm),
+                        (self.unary, counts.unary),
+                        (self.binary, counts.binary)):
+      # One key at a time: dict(mine) may presize the table and change
+      # the iteration order.
+      for key in mine:
+        plain[key] = mine[key]
+    return counts
+
+  def merge(self, other):
+    """
+    Add the counts of other; new keys are added in other's order.
+    """
+    for mine, theirs in ((self.nonterm, other.nonterm),
+                         (self.unary, other.unary),
+                         (self.binary, other.binary)):
+      for key, count in theirs.iteritems():
+        mine[key] = mine.get(key, 0) + count
+    return self
+
+  def load(self, lines):
+    """
+    Read counts in the format written by show(), keeping their order.
+    """
+    for l in lines:
+      l = l.split()
+      count = int(l[0])
+      if l[1] == "NONTERMINAL":
+        d, key = self.nonterm, l[2]
+      elif l[1] == "UNARYRULE":
+        d, key = self.unary, (l[2], l[3])
+      else:
+        d, key = self.binary, (l[2], l[3], l[4])
+      d[key] = d.get(key, 0) + count
+    return self
 
-  def show(self):
+  def show(self, out=None):
+    out = out or sys.stdout
     for symbol, count in self.nonterm.iteritems():
-      print count, "NONTERMINAL", symbol
+      print >>out, count, "NONTERMINAL", symbol
 
     for (sym, word), count in self.unary.iteritems():
-      print count, "UNARYRULE", sym, word
+      print >>out, count, "UNARYRULE", sym, word
 
     for (sym, y1, y2), count in self.binary.iteritems():
-      print count, "BINARYRULE", sym, y1, y2
+      print >>out, count, "BINARYRULE", sym, y1, y2
 
   def count(self, tree):
     """
@@ -31,43 +89,265 @@ class Counts:
     """
     if isinstance(tree, basestring): return
 
-    # Count the non-terminal symbol. 
-    symbol = tree[0]
-    self.nonterm.setdefault(symbol, 0)
-    self.nonterm[symbol] += 1
-    
-    if len(tree) == 3:
-      # It is a binary rule.
-      y1, y2 = (tree[1][0], tree[2][0])
-      key = (symbol, y1, y2)
-      self.binary.setdefault(key, 0)
-      self.binary[(symbol, y1, y2)] += 1
-      
-      # Recursively count the children.
-      self.count(tree[1])
-      self.count(tree[2])
-    elif len(tree) == 2:
-      # It is a unary rule.
-      y1 = tree[1]
-      key = (symbol, y1)
-      self.unary.setdefault(key, 0)
-      self.unary[key] += 1
-
-def main(parse_file):
-  counter = Counts() 
-  for l in open(parse_file):
-    t = json.loads(l)
-    counter.count(t)
+    # Visit the nodes in the order the recursive count did, so keys are
+    # first seen in the same order. The walk is inlined with an explicit
+    # stack (see tree_walk.py): this is the hot loop of counting.
+    nonterm, binary, unary = self.nonterm, self.binary, self.unary
+    stack = [tree]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+      node = pop()
+      # Count the non-terminal symbol. 
+      symbol = node[0]
+      nonterm[symbol] = nonterm.get(symbol, 0) + 1
+
+      if len(node) == 3:
+        # It is a binary rule.
+        left, right = node[1], node[2]
+        key = (symbol, left[0], right[0])
+        binary[key] = binary.get(key, 0) + 1
+        push(right)
+        push(left)
+      elif len(node) == 2:
+        # It is a unary rule.
+        key = (symbol, node[1])
+        unary[key] = unary.get(key, 0) + 1
+
+  def count_treebank(self, trees):
+    """
+    Count every tree of a binary treebank.Treebank at once with array
+    operations. Keys are added in the order count() would first see them,
+    so show() prints the same as counting the json trees.
+    """
+    n = len(trees.names)
+    names = trees.names
+    symbol = trees.symbol.astype(np.int64)
+    nodes = np.flatnonzero(trees.arity > 0)
+    add_keys(self.nonterm, symbol[nodes], lambda k: names[k])
+    nodes = np.flatnonzero(trees.arity == 1)
+    add_keys(self.unary, symbol[nodes] * n + symbol[nodes + 1],
+             lambda k: (names[k // n], names[k % n]))
+    nodes = np.flatnonzero(trees.arity == 2)
+    add_keys(self.binary,
+             (symbol[nodes] * n + symbol[nodes + 1]) * n + symbol[trees.right_child(nodes)],
+             lambda k: (names[k // n // n], names[k // n % n], names[k % n]))
+    return self
+
+def add_keys(d, keys, decode):
+  """
+  Add the occurrences of integer keys, in the order of their first one.
+  """
+  keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+  for k in np.argsort(first):
+    key = decode(int(keys[k]))
+    d[key] = d.get(key, 0) + int(counts[k])
+
+def shard_ranges(parse_file, shards):
+  """
+  Split a file into byte ranges [start, end) that begin on line boundaries.
+  """
+  size = os.path.getsize(parse_file)
+  bounds = [0]
+  with open(parse_file, 'rb') as f:
+    for k in range(1, shards):
+      f.seek(max(size * k // shards - 1, bounds[-1]))
+      f.readline()
+      bounds.append(max(min(f.tell(), size), bounds[-1]))
+  bounds.append(size)
+  return zip(bounds[:-1], bounds[1:])
+
+def count_shard(args):
+  """
+  Count the trees of one byte range, returned serialized by show().
+  """
+  parse_file, start, end = args
+  counter = Counts(ordered=True)
+  with open(parse_file, 'rb') as f:
+    f.seek(start)
+    while f.tell() < end:
+      counter.count(json.loads(f.readline()))
+  out = StringIO()
+  counter.show(out)
+  return out.getvalue()
+
+def count_sharded(parse_file, shards):
+  """
+  Count the shards in separate processes and merge them in file order.
+  """
+  pool = multiprocessing.Pool(shards)
+  results = pool.map(count_shard, [(parse_file, start, end) for start, end
+                                   in shard_ranges(parse_file, shards)])
+  pool.close()
+  pool.join()
+  counter = Counts(ordered=True)
+  for result in results:
+    counter.merge(Counts(ordered=True).load(result.splitlines()))
+  return counter.plain()
+
+# Bytes of memory per key of an ordered Counts, with its words, measured
+# on parse_train.dat.
+ENTRY_BYTES = 600
+KINDS = ("NONTERMINAL", "UNARYRULE", "BINARYRULE")
+
+class Slot(object):
+  """
+  Stands for a key in a dict: it hashes as the key did and is only equal
+  to itself, so a dict of slots has the table, and the iteration order,
+  of a dict of the keys.
+  """
+  __slots__ = ('hash', 'number')
+
+  def __init__(self, hash, number):
+    self.hash = hash
+    self.number = number
+
+  def __hash__(self):
+    return self.hash
+
+def dict_order(hashes):
+  """
+  Insert slots with the hashes of distinct keys into a dict, in order.
+  Return the insertion numbers of the keys in the dict's iteration order.
+  """
+  table = {}
+  for k, h in enumerate(hashes):
+    table[Slot(int(h), k)] = None
+  return [slot.number for slot in table]
+
+def spill(counter, run, directory):
+  """
+  Write the keys of an ordered Counts sorted, with their count and the
+  number of the run and of the key in the order it was first seen.
+  """
+  path = os.path.join(directory, "run%d" % run)
+  with open(path, 'wb') as f:
+    for kind, d in enumerate((counter.nonterm, counter.unary, counter.binary)):
+      lines = []
+      for rank, (key, count) in enumerate(d.iteritems()):
+        if kind == 0:
+          key = (key,)
+        lines.append((' '.join(key).encode('utf-8'), count, rank))
+      lines.sort()
+      for key, count, rank in lines:
+        f.write("%d %s\t%d %d %d\n" % (kind, key, run, rank, count))
+  return path
+
+def read_run(path):
+  """
+  Yield (kind, key, run, rank, count) of a file written by spill.
+  """
+  with open(path, 'rb') as f:
+    for l in f:
+      key, numbers = l.rstrip('\n').split('\t')
+      kind, key = key.split(' ', 1)
+      run, rank, count = numbers.split()
+      yield int(kind), key, int(run), int(rank), int(count)
+
+def merge_runs(paths):
+  """
+  k-way merge of the runs: yield (kind, key, count, first) of every key,
+  in key order, where first orders the keys by their first occurrence.
+  """
+  current = None
+  for kind, key, run, rank, count in heapq.merge(*[read_run(p) for p in paths]):
+    if current is not None and current[0] == kind and current[1] == key:
+      current[2] += count
+      continue
+    if current is not None:
+      yield current
+    # The runs come in file order, so the first run of a key is first.
+    current = [kind, key, count, (run << 32) + rank]
+  if current is not None:
+    yield current
+
+def count_external(parse_file, max_bytes, out=None, directory=None):
+  """
+  Count a file of trees with at most about max_bytes of counts in memory
+  and print them as show() does for the same trees.
+
+  The counts are spilled sorted to temporary files whenever they reach
+  the budget, then merged. show() prints a plain dict in its iteration
+  order, so every key also keeps the rank of its first occurrence: the
+  order of a dict filled in that order is found by dict_order from the
+  key hashes alone. The final order thus costs about 200 bytes a key of
+  the largest kind, whatever max_bytes is: the hash, rank and file
+  offset of every key and a dict of Slot objects, instead of the keys
+  and counts themselves.
+  """
+  out = out or sys.stdout
+  directory = tempfile.mkdtemp(dir=directory)
+  try:
+    paths = []
+    counter = Counts(ordered=True)
+    for tree in treebank.read_trees(parse_file):
+      counter.count(tree)
+      entries = len(counter.nonterm) + len(counter.unary) + len(counter.binary)
+      if entries * ENTRY_BYTES >= max_bytes:
+        paths.append(spill(counter, len(paths), directory))
+        counter = Counts(ordered=True)
+    paths.append(spill(counter, len(paths), directory))
+    counter = None
+
+    # The lines of every kind in key order, then printed in dict order.
+    merged = iter(merge_runs(paths))
+    record = next(merged, None)
+    for kind, name in enumerate(KINDS):
+      path = os.path.join(directory, name)
+      # C longs, the type of hash(): 8 bytes a number on 64-bit unix.
+      offsets, firsts, hashes = array('l'), array('l'), array('l')
+      with open(path, 'wb') as f:
+        while record is not None and record[0] == kind:
+          k, key, count, first = record
+          words = key.decode('utf-8').split(' ')
+          offsets.append(f.tell())
+          firsts.append(first)
+          hashes.append(hash(kind == 0 and words[0] or tuple(words)))
+          f.write("%d %s %s\n" % (count, name, key))
+          record = next(merged, None)
+      order = np.argsort(np.frombuffer(firsts, dtype=np.dtype('l')), kind='mergesort')
+      offsets = np.frombuffer(offsets, dtype=np.dtype('l'))[order]
+      hashes = np.frombuffer(hashes, dtype=np.dtype('l'))[order]
+      firsts = None
+      with open(path, 'rb') as f:
+        for k in dict_order(hashes):
+          f.seek(offsets[k])
+          out.write(f.readline())
+  finally:
+    shutil.rmtree(directory)
+
+def main(parse_file, shards=1, max_bytes=None):
+  if max_bytes:
+    count_external(parse_file, max_bytes)
+    return
+  if treebank.is_treebank(parse_file):
+    # array operations over the whole file, no need for shards
+    counter = Counts().count_treebank(treebank.Treebank(parse_file))
+  elif shards > 1:
+    counter = count_sharded(parse_file, shards)
+  else:
+    counter = Counts()
+    for l in open(parse_file):
+      t = json.loads(l)
+      counter.count(t)
   counter.show()
 
 def usage():
     sys.stderr.write("""
-    Usage: python count_cfg_freq.py [tree_file]
-        Print the counts of a corpus of trees.\n""")
+    Usage: python count_cfg_freq.py [tree_file] [shards]
+           python count_cfg_freq.py [tree_file] --memory MB
+        Print the counts of a corpus of trees, optionally counting
+        shards of the file in parallel processes, or keeping at most
+        about MB megabytes of counts in memory and the rest in sorted
+        temporary files. tree_file is json trees or a binary treebank
+        written by treebank.py.\n""")
 
 if __name__ == "__main__": 
-  if len(sys.argv) != 2:
+  if len(sys.argv) == 4 and sys.argv[2] == '--memory':
+    main(sys.argv[1], max_bytes=int(float(sys.argv[3]) * (1 << 20)))
+    sys.exit(0)
+  if len(sys.argv) not in (2, 3):
     usage()
     sys.exit(1)
-  main(sys.argv[1])
+  main(sys.argv[1], len(sys.argv) == 3 and int(sys.argv[2]) or 1)
   
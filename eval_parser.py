@@ -4,6 +4,9 @@ __author__="Alexander Rush <srush@csail.mit.edu>"
 __date__ ="$Sep 12, 2012"
 
 import sys, re, json, itertools
+import numpy as np
+
+import treebank
 
 """
 Evaluate a set of test parses versus the gold set. 
@@ -14,62 +17,131 @@ def simplify_non_terminal(nt):
   return re.sub(r"\^<.*?>", '', nt)
 
 
+class SimplifiedNames(dict):
+  "simplify_non_terminal of every name looked up, computed once per name."
+  def __missing__(self, nt):
+    simple = self[nt] = simplify_non_terminal(nt)
+    return simple
+
+simplified_names = SimplifiedNames()
+
 def convert_to_spans(tree, start, set): 
-  "Convert a tree into spans (X, i, j) and add to a set." 
-  if len(tree) == 3:
-    # Binary Rule.
-    split = convert_to_spans(tree[1], start, set)
-    end = convert_to_spans(tree[2], split + 1, set)
-    set.add((simplify_non_terminal(tree[0]), start, end))
-    return end
-  elif len(tree) == 2:
-    # Unary Rule.
-    set.add((simplify_non_terminal(tree[0]), start, start))
-    return start
+  """
+  Convert a tree into spans (X, i, j) and add to a set, return its last word.
+  Every node is visited after its children, with an explicit stack: this is
+  the hot loop of evaluation.
+  """
+  add = set.add
+  simple = simplified_names
+  # Nodes to visit, and (node, first word) of the binary nodes whose
+  # children are being visited.
+  stack = [tree]
+  pop = stack.pop
+  push = stack.append
+  w = start
+  while stack:
+    node = pop()
+    if node.__class__ is tuple:
+      add((simple[node[0][0]], node[1], w - 1))
+    elif len(node) == 2:
+      add((simple[node[0]], w, w))
+      w += 1
+    else:
+      push((node, w))
+      push(node[2])
+      push(node[1])
+  return w - 1
+
+def read_spans(tree_file):
+  """
+  Yield (spans, length, text) for every tree of a json or binary tree
+  file; text is the json line, or the tree number in a binary file.
+  """
+  if not treebank.is_treebank(tree_file):
+    for l in open(tree_file):
+      spans = set()
+      length = convert_to_spans(json.loads(l), 1, spans)
+      yield spans, length, l
+    return
+  trees = treebank.Treebank(tree_file)
+  simple = [simplify_non_terminal(nt) for nt in trees.names]
+  leaf = trees.arity == 0
+  # number of words up to and including every node
+  words = np.cumsum(leaf)
+  for k in range(len(trees)):
+    start, end = trees.tree_start[k], trees.tree_start[k + 1]
+    before = words[start - 1] if start else 0
+    nodes = start + np.flatnonzero(~leaf[start:end])
+    i = words[nodes] - before + 1
+    j = words[nodes + trees.size[nodes] - 1] - before
+    spans = set(zip([simple[s] for s in trees.symbol[nodes]], i.tolist(), j.tolist()))
+    yield spans, int(words[end - 1] - before), "%s tree %d\n" % (tree_file, k + 1)
 
 def output_header():
   print "%10s  %10s  %10s  %10s   %10s"%("Type", "Total", "Precision", "Recall", "F1 Score")
   print "==============================================================="
 
 def output_row(name, right, total_gold, total_test):
-  p = right / float(total_test)
-  r = right / float(total_gold)
-  print "%10s        %4d     %0.3f        %0.3f        %0.3f"%(name, total_gold, p, r, (2 * p * r) / float(p + r))
-
-def main(key_file, prediction_file):
-  right = 0
+  p, r, f = scores(right, total_gold, total_test)
+  print "%10s        %4d     %0.3f        %0.3f        %0.3f"%(name, total_gold, p, r, f)
+
+def scores(right, total_gold, total_test):
+  "Precision, recall and F1 score, 0 where there is nothing to divide by."
+  p = total_test and right / float(total_test) or 0.0
+  r = total_gold and right / float(total_gold) or 0.0
+  return p, r, p + r and (2 * p * r) / float(p + r) or 0.0
+
+def evaluate(key_file, prediction_file):
+  """
+  Compare the spans of the test parses with the gold set.
+  Returns (right, total_gold, total_test, nt_right, nt_total_gold, nt_total_test).
+  """
+  return evaluate_many(key_file, [prediction_file])[0]
+
+def evaluate_many(key_file, prediction_files):
+  """
+  Compare several prediction files with the gold set in one pass: every
+  gold tree is decoded and converted to spans once, the predictions are
+  read in lockstep with it. Every file can be json trees or a binary
+  treebank.
+  Returns the tuple of evaluate for every prediction file, in order.
+  """
+  k = len(prediction_files)
+  right = [0] * k
   total_gold = 0
-  total_test = 0
-  nt_right = {}
+  total_test = [0] * k
+  nt_right = [{} for f in prediction_files]
   nt_total_gold = {}
-  nt_total_test = {}
-
-  for l1, l2 in itertools.izip(open(key_file), open(prediction_file)):
-    set1 = set()
-    set2 = set()
-    tree1 = json.loads(l1)
-    tree2 = json.loads(l2)
-    len1 = convert_to_spans(tree1, 1, set1)
-    len2 = convert_to_spans(tree2, 1, set2)
-    if len1 != len2: 
-      print >>sys.stderr, "Sentence length does not match", l1, l2 
-    
-    # Compute precision, recall.
-    for (nt, i, j) in set1 & set2:
-      nt_right.setdefault(nt, 0)
-      nt_right[nt] += 1
+  nt_total_test = [{} for f in prediction_files]
+
+  for trees in itertools.izip(read_spans(key_file),
+                              *[read_spans(f) for f in prediction_files]):
+    set1, len1, l1 = trees[0]
 
     for (nt, i, j) in set1:
       nt_total_gold.setdefault(nt, 0)
       nt_total_gold[nt] += 1
+    total_gold += len(set1)
 
-    for (nt, i, j) in set2:
-      nt_total_test.setdefault(nt, 0)
-      nt_total_test[nt] += 1
+    for n, (set2, len2, l2) in enumerate(trees[1:]):
+      if len1 != len2: 
+        print >>sys.stderr, "Sentence length does not match", l1, l2 
+    
+      # Compute precision, recall.
+      for (nt, i, j) in set1 & set2:
+        nt_right[n].setdefault(nt, 0)
+        nt_right[n][nt] += 1
+
+      for (nt, i, j) in set2:
+        nt_total_test[n].setdefault(nt, 0)
+        nt_total_test[n][nt] += 1
       
-    total_gold += len(set1)
-    total_test += len(set2)
-    right += len(set1 & set2)
+      total_test[n] += len(set2)
+      right[n] += len(set1 & set2)
+  return [(right[n], total_gold, total_test[n], nt_right[n], nt_total_gold, nt_total_test[n])
+          for n in range(k)]
+
+def output_report(right, total_gold, total_test, nt_right, nt_total_gold, nt_total_test):
   output_header()
   N = nt_right.keys()
   N.sort()
@@ -81,16 +153,66 @@ def main(key_file, prediction_file):
   output_row("total", right, total_gold, total_test)
   # (name, total_gold, p, r, (2 * p * r) / float(p + r))
 
+def score_dict(right, total_gold, total_test):
+  p, r, f = scores(right, total_gold, total_test)
+  return {"right": right, "gold": total_gold, "test": total_test,
+          "precision": p, "recall": r, "f1": f}
+
+def json_report(prediction_file, right, total_gold, total_test,
+                nt_right, nt_total_gold, nt_total_test):
+  """
+  The scores of one prediction file as a dictionary, for every nonterminal
+  of the gold or the test parses.
+  """
+  labels = set(nt_total_gold) | set(nt_total_test)
+  return {"file": prediction_file,
+          "total": score_dict(right, total_gold, total_test),
+          "nonterminals": dict((nt, score_dict(nt_right.get(nt, 0),
+                                               nt_total_gold.get(nt, 0),
+                                               nt_total_test.get(nt, 0)))
+                               for nt in labels)}
+
+def main(key_file, *prediction_files, **options):
+  """
+  Print the scores of every prediction file; with several files, a table
+  per file then a summary of their totals. output='json' prints one json
+  document instead.
+  """
+  results = evaluate_many(key_file, prediction_files)
+  if options.get("output") == "json":
+    print json.dumps({"key_file": key_file,
+                      "predictions": [json_report(f, *result)
+                                      for f, result in zip(prediction_files, results)]},
+                     indent=2, sort_keys=True)
+    return
+  if len(prediction_files) == 1:
+    output_report(*results[0])
+    return
+  for f, result in zip(prediction_files, results):
+    print f
+    output_report(*result)
+    print
+  print "%10s  %10s  %10s  %10s   %10s"%("File", "Total", "Precision", "Recall", "F1 Score")
+  print "==============================================================="
+  for f, result in zip(prediction_files, results):
+    output_row(f, *result[:3])
+
 
 def usage():
     sys.stderr.write("""
-    Usage: python eval_parser.py [key_file] [output_file]
-        Evalute the accuracy of a output trees compared to a key file.\n""")
+    Usage: python eval_parser.py [--json] [key_file] [output_file] [output_file ...]
+        Evalute the accuracy of output trees compared to a key file.
+        --json prints the scores as json.\n""")
 
 if __name__ == "__main__": 
-  if len(sys.argv) != 3:
+  args = sys.argv[1:]
+  output = "text"
+  if args and args[0] == "--json":
+    output = "json"
+    args = args[1:]
+  if len(args) < 2:
     usage()
     sys.exit(1)
-  main(sys.argv[1], sys.argv[2]) 
+  main(*args, output=output) 
 
 
@@ -0,0 +1,153 @@
+"""
+Lazy k-best parses over a 1-best cky.Chart (algorithm 3 of Huang and
+Chiang, Better k-best parsing, 2005)
+
+the chart keeps one backpointer per (i, j, X). the k-best lists of an
+item are only built when a better derivation of one of its parents asks
+for them, one derivation at a time, from a heap of candidates: the best
+derivation along each rule and split, and the successors of the ones
+already taken. the first derivation of every item is the one cky.py
+picks, with the same tie-breaks.
+"""
+
+import heapq
+import json
+import numpy as np
+
+class KBest(object):
+    """
+    k-best derivations of the items of one sentence
+    """
+    def __init__(self, sentence, chart, grammar):
+        """
+        :param chart: filled cky.Chart of the sentence
+        """
+        self.sentence = sentence
+        self.grammar = grammar
+        self.n = chart.n
+        # 1-best scores, [i, j, X]
+        self.best = np.zeros((self.n + 2, self.n + 2, grammar.n_symbols))
+        for (i, j), cell in chart.cells.iteritems():
+            self.best[i, j, cell['x']] = cell['score']
+        # derivations found of every item, best first:
+        # (score, rule, split, k1, k2), rule -1 for a word
+        self.derivations = {}
+        self.candidates = {}
+        self.seen = {}
+
+    def init_candidates(self, i, j, x):
+        """
+        the best derivation along every rule of X and split of (i, j)
+        """
+        g = self.grammar
+        if i == j:
+            score = self.best[i, i, x]
+            self.derivations[(i, j, x)] = score and [(score, -1, -1, 0, 0)] or []
+            self.candidates[(i, j, x)] = []
+            return
+        k = np.searchsorted(g.group_lhs, x)
+        if k == len(g.group_lhs) or g.group_lhs[k] != x:
+            rs = g.rule_ids[:0]
+        else:
+            rs = g.rule_ids[g.group_start[k]:g.group_start[k] + g.group_len[k]]
+        # [rule, split], same product order as pi()
+        scores = g.rule_prob[rs, None] \
+                 * self.best[i, i:j][:, g.rule_left[rs]].T \
+                 * self.best[i + 1:j + 1, j][:, g.rule_right[rs]].T
+        r, s = np.nonzero(scores)
+        # ties go to the first rule, then the first split, as in cky.fill_span
+        heap = [(-score, rule, split, 0, 0) for score, rule, split
+                in zip(scores[r, s].tolist(), rs[r].tolist(), (i + s).tolist())]
+        heapq.heapify(heap)
+        self.derivations[(i, j, x)] = []
+        self.candidates[(i, j, x)] = heap
+        self.seen[(i, j, x)] = set((rule, split, 0, 0) for c, rule, split, k1, k2 in heap)
+
+    def kth(self, i, j, x, k):
+        """
+        :return: the k-th best derivation (from 0) of (i, j, X), None if
+                it has fewer than k + 1
+        """
+        item = (i, j, x)
+        if item not in self.derivations:
+            self.init_candidates(i, j, x)
+        derivations = self.derivations[item]
+        heap = self.candidates[item]
+        while len(derivations) <= k:
+            if derivations and derivations[-1][1] >= 0:
+                self.push_successors(i, j, x, derivations[-1])
+            if not heap:
+                break
+            score, rule, split, k1, k2 = heapq.heappop(heap)
+            derivations.append((-score, rule, split, k1, k2))
+        return derivations[k] if k < len(derivations) else None
+
+    def push_successors(self, i, j, x, derivation):
+        """
+        add the derivations that take the next best derivation of one of
+        the children of derivation to the candidates of (i, j, X)
+        """
+        g = self.grammar
+        score, rule, split, k1, k2 = derivation
+        y1 = g.rule_left[rule]
+        y2 = g.rule_right[rule]
+        seen = self.seen[(i, j, x)]
+        for n1, n2 in ((k1 + 1, k2), (k1, k2 + 1)):
+            if (rule, split, n1, n2) in seen:
+                continue
+            left = self.kth(i, split, y1, n1)
+            right = self.kth(split + 1, j, y2, n2)
+            if left is None or right is None:
+                continue
+            seen.add((rule, split, n1, n2))
+            heapq.heappush(self.candidates[(i, j, x)],
+                           (-(g.rule_prob[rule] * left[0] * right[0]), rule, split, n1, n2))
+
+    def tree_json(self, x, k):
+        """
+        :return: the k-th best tree of X over the sentence as json, in the
+                format of cky.tree_json
+        """
+        g = self.grammar
+        symbols = g.json_symbols
+        pieces = []
+        stack = [(1, self.n, x, k)]
+        while stack:
+            item = stack.pop()
+            if item.__class__ is str:
+                pieces.append(item)
+                continue
+            i, j, y, k = item
+            if i == j:
+                pieces.append('[%s, %s]' % (symbols[y], json.dumps(self.sentence[i])))
+                continue
+            score, rule, split, k1, k2 = self.kth(i, j, y, k)
+            pieces.append('[%s, ' % symbols[y])
+            stack.append(']')
+            stack.append((split + 1, j, g.rule_right[rule], k2))
+            stack.append(', ')
+            stack.append((i, split, g.rule_left[rule], k1))
+        return ''.join(pieces)
+
+def kbest_trees(sentence, chart, grammar, x, k):
+    """
+    :param chart: filled cky.Chart of the sentence
+    :param x: index of the root nonterminal, see cky.best_root
+    :return: [(log probability, json tree)] of the k best trees under X,
+            fewer if the sentence does not have k
+    """
+    kbest = KBest(sentence, chart, grammar)
+    trees = []
+    for rank in range(k):
+        derivation = kbest.kth(1, chart.n, x, rank)
+        if derivation is None:
+            break
+        trees.append((float(np.log(derivation[0])), kbest.tree_json(x, rank)))
+    return trees
+
+def kbest_json(trees):
+    """
+    :param trees: as returned by kbest_trees
+    :return: one json line [[log probability, tree], ...]
+    """
+    return '[%s]' % ', '.join('[%r, %s]' % (log_prob, tree) for log_prob, tree in trees)
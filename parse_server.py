@@ -0,0 +1,257 @@
+#! /usr/bin/python
+"""
+Long-running parser that keeps the grammar and the vocabulary in memory.
+
+every request is one tokenized sentence per line, every reply is the
+json tree 5.py would write for it, in the order the requests came in.
+requests that arrive close together are parsed as one batch.
+the line ':stats' replies with the latency percentiles, the queue depth
+and the number of requests and batches served so far.
+
+serve on a unix socket
+python parse_server.py --socket /tmp/parser.sock
+or on stdin/stdout
+python parse_server.py < parse_dev.dat > prediction
+"""
+
+import os
+import sys
+import json
+import time
+import Queue
+import argparse
+import threading
+import collections
+import SocketServer
+import multiprocessing
+import numpy as np
+
+from scripts import parser_script
+
+parser_module = parser_script()
+
+STATS_COMMAND = ':stats'
+
+class Request(object):
+    """
+    one line of a client, answered once reply is set
+    """
+    def __init__(self, line):
+        self.line = line
+        self.reply = None
+        self.arrival = time.time()
+        self.done = threading.Event()
+
+    def answer(self, reply):
+        self.reply = reply
+        self.done.set()
+
+class ParseServer(object):
+    """
+    parses the queued requests in batches on one thread
+    """
+    def __init__(self, parser, batch_window=0.005, max_batch=64, workers=1,
+                 history=10000):
+        """
+        :param parser: as returned by load_parser in 5.py
+        :param batch_window: seconds to wait for more requests after the
+                first one of a batch
+        :param max_batch: most requests parsed in one batch
+        :param workers: processes parsing a batch, 1 to parse in-thread
+        :param history: number of recent latencies kept for the percentiles
+        """
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue = Queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.served = 0
+        self.batches = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        parser_module._parser = parser
+        self.workers = workers
+        self.pool = None
+        if workers > 1:
+            # forked after the parser is set, so the workers share it
+            self.pool = multiprocessing.Pool(workers)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, line):
+        """
+        :return: a Request, wait on its done event for the reply
+        """
+        request = Request(line.strip())
+        if request.line == STATS_COMMAND:
+            request.answer(json.dumps(self.stats()))
+        else:
+            self.queue.put(request)
+        return request
+
+    def close(self):
+        """
+        answer the queued requests, then stop the batch thread and the
+        worker processes
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def next_batch(self):
+        """
+        :return: the next requests, None once close was called
+        """
+        request = self.queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self.queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            with self.lock:
+                self.in_flight = len(batch)
+            try:
+                replies = self.parse_batch([request.line for request in batch])
+            except Exception:
+                # find the bad requests, the others are still answered
+                replies = []
+                for request in batch:
+                    try:
+                        replies.extend(self.parse_batch([request.line]))
+                    except Exception, e:
+                        replies.append(json.dumps({'error': repr(e)}))
+            now = time.time()
+            with self.lock:
+                for request in batch:
+                    self.latencies.append(now - request.arrival)
+                self.served += len(batch)
+                self.batches += 1
+                self.in_flight = 0
+            for request, reply in zip(batch, replies):
+                request.answer(reply)
+
+    def parse_batch(self, lines):
+        """
+        :return: the json tree of every line
+        """
+        sentences = [[''] + line.split() for line in lines]
+        for s in sentences:
+            if len(s) == 1:
+                raise ValueError("empty sentence")
+        if self.pool is not None and len(sentences) > 1:
+            size = -(-len(sentences) // self.workers)
+            chunks = self.pool.map(parser_module.parse_chunk,
+                                   [sentences[k:k + size]
+                                    for k in range(0, len(sentences), size)])
+            results = [result for chunk in chunks for result in chunk]
+        else:
+            results = parser_module.parse_chunk(sentences)
+        return [tree for tree, counters in results]
+
+    def stats(self):
+        """
+        :return: latency percentiles in milliseconds over the recent
+                requests, requests waiting or being parsed, and totals
+        """
+        with self.lock:
+            latencies = np.asarray(self.latencies) * 1000.0
+            stats = {'queue_depth': self.queue.qsize() + self.in_flight,
+                     'served': self.served, 'batches': self.batches}
+        for p in (50, 90, 99):
+            stats['latency_p%d_ms' % p] = \
+                round(float(np.percentile(latencies, p)), 3) if len(latencies) else None
+        return stats
+
+def serve_lines(server, lines, out):
+    """
+    answer every line of an input stream in order; a writer thread waits
+    for the replies so that later lines can join the same batch
+    """
+    pending = Queue.Queue()
+
+    def write():
+        while True:
+            request = pending.get()
+            if request is None:
+                return
+            request.done.wait()
+            out.write(request.reply + '\n')
+            out.flush()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    for line in iter(lines.readline, ''):
+        pending.put(server.submit(line))
+    pending.put(None)
+    writer.join()
+
+class LineHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        serve_lines(self.server.parse_server, self.rfile, self.wfile)
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def main(args):
+    options = {}
+    if args.beam:
+        options['beam'] = args.beam
+    if args.threshold:
+        options['threshold'] = args.threshold
+    parser = parser_module.load_parser('cky', args.grammar, args.rare_threshold,
+                                       signatures=args.signatures, **options)
+    server = ParseServer(parser, args.batch_window / 1000.0, args.max_batch,
+                         args.workers)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        unix_server = UnixServer(args.socket, LineHandler)
+        unix_server.parse_server = server
+        try:
+            unix_server.serve_forever()
+        finally:
+            os.remove(args.socket)
+            server.close()
+    else:
+        try:
+            serve_lines(server, sys.stdin, sys.stdout)
+        finally:
+            server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident PCFG parser.")
+    parser.add_argument('--socket', default=None,
+                        help="unix socket to listen on, stdin/stdout if not given")
+    parser.add_argument('--batch-window', type=float, default=5.0,
+                        help="milliseconds to wait for more requests of a batch")
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--grammar', default=parser_module.GRAMMAR_FILE)
+    parser.add_argument('--rare-threshold', type=int,
+                        default=parser_module.RARE_THRESHOLD)
+    parser.add_argument('--signatures', action='store_true',
+                        help="replace rare words by their signature class")
+    parser.add_argument('--beam', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=None)
+    main(parser.parse_args())
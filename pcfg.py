@@ -0,0 +1,450 @@
+#! /usr/bin/python
+"""
+Integer-indexed representation of a PCFG, used by the CKY engine in cky.py,
+and its compiled binary form.
+
+compile the grammar once with
+python pcfg.py cfg_rare.counts cfg.counts cfg_rare.pcfg
+the parser then memory-maps cfg_rare.pcfg instead of re-reading the counts
+"""
+
+import os
+import sys
+import copy
+import json
+import mmap
+import struct
+import numpy as np
+from collections import OrderedDict
+
+from vocab import Vocabulary, RARE_THRESHOLD, file_checksum
+
+def create_counts_iterator(count_file):
+    """
+    :param count_file: count file
+    :return: an iterator
+    """
+    l = count_file.readline()
+    while l:
+        line = l.strip().split()
+        if line[1] != 'WORDTAG':
+            #print line
+            yield line
+        l = count_file.readline()
+
+def build_rule_count_dict(counts_iterator):
+    """
+    build a dictionary with counts of each rule
+    :param counts_iterator: an iterator of count file
+    :return: {X: {w: 12, y1y2:13}}
+    """
+    rule_count_dict = {}
+    for l in counts_iterator:
+        if l[1] != 'NONTERMINAL':
+            x = l[2]
+            y = l[1] == 'UNARYRULE' and l[3] or l[3] + ' ' + l[4]
+            if x not in rule_count_dict:
+                rule_count_dict[x] = {}
+            rule_count_dict[x][y] = int(l[0])
+    return rule_count_dict
+
+def build_para_dict(rule_count_dict):
+    """
+    build a dictionary with probability of each rule
+    :param rule_count_dict: a dictionary with count of each rule
+    :return: {X: {w: 0.12, y1y2: 0.13}}
+    """
+    para_dict = copy.deepcopy(rule_count_dict)
+    for key in para_dict:
+        deno = sum(para_dict[key].values())
+        for subkey, count in para_dict[key].iteritems():
+            para_dict[key][subkey] = float(count)/deno
+    return para_dict
+
+def prune_rules(rule_count_dict, min_count=None, min_prob=None, top_k=None):
+    """
+    drop binary rules of a build_rule_count_dict table, the rules X -> w
+    are all kept so that every word stays covered
+    :param min_count: drop X -> Y1 Y2 seen fewer times than this
+    :param min_prob: drop X -> Y1 Y2 below this probability in the
+            unpruned grammar
+    :param top_k: keep at most this many binary rules per X, the most
+            frequent ones
+    :return: a new table, with the same counts for the rules kept;
+            build_para_dict normalizes it again
+    """
+    pruned = {}
+    for x, rules in rule_count_dict.iteritems():
+        total = float(sum(rules.values()))
+        binary = [(count, r) for r, count in rules.iteritems()
+                  if ' ' in r and count >= (min_count or 0)
+                  and count / total >= (min_prob or 0.0)]
+        if top_k:
+            binary = sorted(binary, key=lambda (count, r): (-count, r))[:top_k]
+        kept = set(r for count, r in binary)
+        row = {}
+        for r, count in rules.iteritems():
+            if ' ' not in r or r in kept:
+                row[r] = count
+        if row:
+            pruned[x] = row
+    return pruned
+
+def check_normalized(para_dict, tolerance=1e-8):
+    """
+    :raise ValueError: if the rules of some X do not sum to one
+    """
+    for x, rules in para_dict.iteritems():
+        total = sum(rules.values())
+        if abs(total - 1.0) > tolerance:
+            raise ValueError("the rules of %s sum to %r" % (x, total))
+
+def build_lexicon(para_dict):
+    """
+    invert the unary rules of a parameter dictionary
+    :return: {w: {X: q(X -> w)}}, only the nonterminals that can emit w
+    """
+    lexicon = {}
+    for x, rules in para_dict.iteritems():
+        for r, q in rules.iteritems():
+            if ' ' not in r:
+                lexicon.setdefault(r, {})[x] = q
+    return lexicon
+
+class Grammar(object):
+    """
+    A PCFG with every nonterminal interned to an integer.
+
+    binary rules X -> Y1 Y2 are kept as parallel arrays
+    (rule_lhs, rule_left, rule_right, rule_prob). Rules are grouped by
+    their left-hand side and, inside a group, listed in the same order
+    as parameters[X].keys(), so ties are broken the way pi() breaks them.
+    the lexicon maps a word to the arrays (tags, probs) of its unary rules.
+    symbol_count is the training count of every X, the total of the
+    counts its rules were normalized by.
+    """
+    def __init__(self, symbols, rule_lhs, rule_left, rule_right, rule_prob,
+                 lexicon, symbol_count=None):
+        self.symbols = list(symbols)
+        self.index = dict((x, k) for k, x in enumerate(self.symbols))
+        self.n_symbols = len(self.symbols)
+        self.json_symbols = [json.dumps(x) for x in self.symbols]
+        self.rule_lhs = np.asarray(rule_lhs, dtype=np.int32)
+        self.rule_left = np.asarray(rule_left, dtype=np.int32)
+        self.rule_right = np.asarray(rule_right, dtype=np.int32)
+        self.rule_prob = np.asarray(rule_prob, dtype=np.float64)
+        self.rule_log_prob = np.log(self.rule_prob)
+        self.n_rules = len(self.rule_lhs)
+        self.rule_ids = np.arange(self.n_rules)
+        self.lexicon = lexicon
+        if symbol_count is None:
+            symbol_count = np.ones(self.n_symbols)
+        self.symbol_count = np.asarray(symbol_count, dtype=np.float64)
+
+        # boundaries of the rule groups sharing a left-hand side
+        change = np.ones(self.n_rules, dtype=bool)
+        change[1:] = self.rule_lhs[1:] != self.rule_lhs[:-1]
+        self.group_start = np.flatnonzero(change)
+        self.group_lhs = self.rule_lhs[self.group_start]
+        self.group_len = np.diff(np.append(self.group_start, self.n_rules))
+
+    @classmethod
+    def from_parameters(cls, parameters, rule_count_dict=None):
+        """
+        build an indexed grammar from a parameter dictionary
+        :param parameters: {X: {w: 0.12, 'Y1 Y2': 0.13}}, as returned by
+                build_para_dict
+        :param rule_count_dict: the counts parameters was normalized from,
+                for symbol_count
+        :return: a Grammar
+        """
+        symbols = list(parameters)
+        index = dict((x, k) for k, x in enumerate(symbols))
+
+        def intern(x):
+            if x not in index:
+                index[x] = len(symbols)
+                symbols.append(x)
+            return index[x]
+
+        rule_lhs, rule_left, rule_right, rule_prob = [], [], [], []
+        lexicon = {}
+        for x in parameters:
+            for r in parameters[x].keys():
+                y = r.split()
+                if len(y) == 2:
+                    rule_lhs.append(index[x])
+                    rule_left.append(intern(y[0]))
+                    rule_right.append(intern(y[1]))
+                    rule_prob.append(parameters[x][r])
+                else:
+                    lexicon.setdefault(r, []).append((index[x], parameters[x][r]))
+        for w, entries in lexicon.iteritems():
+            tags, probs = zip(*entries)
+            lexicon[w] = (np.asarray(tags, dtype=np.int32),
+                          np.asarray(probs, dtype=np.float64))
+        symbol_count = None
+        if rule_count_dict is not None:
+            symbol_count = np.zeros(len(symbols))
+            for x, rules in rule_count_dict.iteritems():
+                if x in index:
+                    symbol_count[index[x]] = sum(rules.values())
+        return cls(symbols, rule_lhs, rule_left, rule_right, rule_prob, lexicon,
+                   symbol_count)
+
+    def parameters(self):
+        """
+        :return: the parameter dictionary of the grammar, {X: {w: 0.12,
+                'Y1 Y2': 0.13}}, with the symbols and the rules of every X
+                in the order of its arrays: from_parameters builds the same
+                grammar from it
+        """
+        parameters = OrderedDict((x, OrderedDict()) for x in self.symbols)
+        for r in range(self.n_rules):
+            parameters[self.symbols[self.rule_lhs[r]]][self.rule(r)] = float(self.rule_prob[r])
+        for w, (tags, probs) in self.lexicon.iteritems():
+            for x, q in zip(tags, probs):
+                parameters[self.symbols[x]][w] = float(q)
+        # symbols only seen as children are added back by from_parameters
+        for x in self.symbols:
+            if not parameters[x]:
+                del parameters[x]
+        return parameters
+
+    def rule(self, r):
+        """
+        :param r: index of a binary rule
+        :return: right-hand side of the rule as 'Y1 Y2', the key used
+                in the parameter dictionary
+        """
+        return self.symbols[self.rule_left[r]] + ' ' + \
+               self.symbols[self.rule_right[r]]
+
+    def best_tag(self, word):
+        """
+        :return: index of the tag seen most often with word in training,
+                the X with the largest count(X) * q(X -> w), None if word
+                is not in the lexicon
+        """
+        if word not in self.lexicon:
+            return None
+        tags, probs = self.lexicon[word]
+        return tags[np.argmax(self.symbol_count[tags] * probs)]
+
+# compiled grammar file:
+#   MAGIC, uint32 length of a json header, the header, then the arrays.
+# the header records the checksums of the counts files the grammar came
+# from and, for every array, [offset, dtype, length]. string tables are
+# stored as one utf-8 blob plus an int64 array of offsets.
+MAGIC = 'PCFGBIN2'
+ALIGN = 8
+
+def pack_strings(strings):
+    """
+    :return: (blob, offsets), string k is blob[offsets[k]:offsets[k + 1]]
+    """
+    encoded = [s.encode('utf-8') if isinstance(s, unicode) else s for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in encoded])
+    return np.frombuffer(''.join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(blob, offsets):
+    data = blob.tostring()
+    return [data[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+
+def save_arrays(path, magic, header, arrays):
+    """
+    write named arrays after the magic string and a json header, each one
+    aligned so that load_arrays can map it in place
+    :param header: json-serializable dictionary, 'sections' is added to it
+    :param arrays: [(name, numpy array)]
+    """
+    sections = {}
+    offset = 0
+    for name, a in arrays:
+        sections[name] = [offset, a.dtype.str, len(a)]
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    header = json.dumps(dict(header, sections=sections))
+    start = -(-(len(magic) + 4 + len(header)) // ALIGN) * ALIGN
+    with open(path, 'wb') as f:
+        f.write(magic + struct.pack('<I', len(header)) + header)
+        for name, a in arrays:
+            f.seek(start + sections[name][0])
+            f.write(np.ascontiguousarray(a).tostring())
+        f.truncate(start + offset)
+
+def read_header(path, magic=MAGIC):
+    """
+    :return: (header, offset of the first array)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a %s file" % (path, magic))
+        size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size))
+    start = -(-(len(magic) + 4 + size) // ALIGN) * ALIGN
+    return header, start
+
+def load_arrays(path, magic=MAGIC):
+    """
+    memory-map a file written by save_arrays
+    :return: (header, {name: read-only view of the file})
+    """
+    header, start = read_header(path, magic)
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    a = {}
+    for name, (offset, dtype, length) in header['sections'].iteritems():
+        a[name] = np.frombuffer(buf, dtype=np.dtype(str(dtype)), count=length,
+                                offset=start + offset)
+    return header, a
+
+def save_grammar(grammar, frequent_words, sources, grammar_file):
+    """
+    write a compiled grammar
+    :param frequent_words: words that are not replaced by '_RARE_'
+    :param sources: {counts file: checksum} the grammar was built from
+    """
+    words = list(grammar.lexicon)
+    lex_ptr = np.zeros(len(words) + 1, dtype=np.int64)
+    lex_ptr[1:] = np.cumsum([len(grammar.lexicon[w][0]) for w in words])
+    lex_tag = np.concatenate([grammar.lexicon[w][0] for w in words] or [[]])
+    lex_prob = np.concatenate([grammar.lexicon[w][1] for w in words] or [[]])
+    symbol_blob, symbol_offsets = pack_strings(grammar.symbols)
+    word_blob, word_offsets = pack_strings(words)
+    frequent_blob, frequent_offsets = pack_strings(sorted(frequent_words))
+    arrays = [
+        ('symbol_blob', symbol_blob), ('symbol_offsets', symbol_offsets),
+        ('rule_lhs', grammar.rule_lhs), ('rule_left', grammar.rule_left),
+        ('rule_right', grammar.rule_right), ('rule_prob', grammar.rule_prob),
+        ('symbol_count', grammar.symbol_count),
+        ('word_blob', word_blob), ('word_offsets', word_offsets),
+        ('lex_ptr', lex_ptr), ('lex_tag', lex_tag.astype(np.int32)),
+        ('lex_prob', lex_prob.astype(np.float64)),
+        ('frequent_blob', frequent_blob), ('frequent_offsets', frequent_offsets),
+    ]
+    save_arrays(grammar_file, MAGIC, {'sources': sources}, arrays)
+
+def load_grammar(grammar_file):
+    """
+    memory-map a compiled grammar, the rule arrays and the lexicon are
+    read-only views of the file
+    :return: (grammar, frequent_words)
+    """
+    header, a = load_arrays(grammar_file)
+    symbols = unpack_strings(a['symbol_blob'], a['symbol_offsets'])
+    words = unpack_strings(a['word_blob'], a['word_offsets'])
+    lex_ptr = a['lex_ptr']
+    lexicon = {}
+    for k, w in enumerate(words):
+        lexicon[w] = (a['lex_tag'][lex_ptr[k]:lex_ptr[k + 1]],
+                      a['lex_prob'][lex_ptr[k]:lex_ptr[k + 1]])
+    grammar = Grammar(symbols, a['rule_lhs'], a['rule_left'], a['rule_right'],
+                      a['rule_prob'], lexicon, a['symbol_count'])
+    frequent_words = set(unpack_strings(a['frequent_blob'], a['frequent_offsets']))
+    return grammar, frequent_words
+
+# the entries of grammar_sources that are not counts file checksums
+SOURCE_FIELDS = ('rare counts file', 'counts file', 'rare threshold', 'pruning')
+
+def grammar_sources(rare_counts_file, counts_file, threshold, pruning=None):
+    """
+    :param pruning: keyword arguments of prune_rules, if the grammar was
+            pruned
+    :return: what a compiled grammar depends on, stored in its header
+    """
+    sources = {rare_counts_file: file_checksum(rare_counts_file),
+               counts_file: file_checksum(counts_file),
+               'rare counts file': rare_counts_file, 'counts file': counts_file,
+               'rare threshold': threshold}
+    if pruning:
+        sources['pruning'] = pruning
+    return sources
+
+def recorded_sources(grammar_file):
+    """
+    :return: the grammar_sources stored in a compiled grammar, {} if it
+            cannot be read
+    """
+    try:
+        header, start = read_header(grammar_file)
+    except (IOError, ValueError):
+        return {}
+    return header['sources']
+
+def grammar_pruning(grammar_file):
+    """
+    :return: the prune_rules arguments a compiled grammar was made with,
+            None if it was not pruned or cannot be read
+    """
+    return recorded_sources(grammar_file).get('pruning')
+
+def compile_grammar(rare_counts_file, counts_file, grammar_file,
+                    threshold=RARE_THRESHOLD, pruning=None):
+    """
+    read the counts files, normalize the PCFG and write it compiled
+    :param rare_counts_file: counts with rare words replaced, cfg_rare.counts
+    :param counts_file: original counts, cfg.counts, for the frequent words
+    :param threshold: words seen fewer times than this are rare, it must
+            be the one cfg_rare.counts was made with
+    :param pruning: optional keyword arguments of prune_rules
+    """
+    with open(rare_counts_file) as f:
+        rule_count_dict = build_rule_count_dict(create_counts_iterator(f))
+    if pruning:
+        rule_count_dict = prune_rules(rule_count_dict, **pruning)
+    para_dict = build_para_dict(rule_count_dict)
+    check_normalized(para_dict)
+    frequent_words = Vocabulary.from_counts_file(counts_file, threshold).frequent_words()
+    save_grammar(Grammar.from_parameters(para_dict, rule_count_dict), frequent_words,
+                 grammar_sources(rare_counts_file, counts_file, threshold, pruning),
+                 grammar_file)
+
+def is_stale(grammar_file, rare_counts_file, counts_file, threshold=RARE_THRESHOLD,
+             pruning=None):
+    """
+    :return: True if grammar_file is missing, unreadable or was compiled
+            from different counts files, rare threshold or pruning
+    """
+    try:
+        header, start = read_header(grammar_file)
+    except (IOError, ValueError):
+        return True
+    return header['sources'] != grammar_sources(rare_counts_file, counts_file,
+                                                threshold, pruning)
+
+def open_grammar(rare_counts_file, counts_file, grammar_file,
+                 threshold=RARE_THRESHOLD):
+    """
+    load a compiled grammar, (re)compiling it first if it is stale; a
+    pruned grammar is compiled again with the same pruning. a grammar
+    compiled from other counts files (such as the markovized one of
+    coarse_to_fine.py) is kept up to date with those, with its own rare
+    threshold; it is loaded as it is if they are gone
+    :return: (grammar, frequent_words)
+    """
+    sources = recorded_sources(grammar_file)
+    pruning = sources.get('pruning')
+    recorded = set(k for k in sources if k not in SOURCE_FIELDS)
+    if recorded and recorded != set([rare_counts_file, counts_file]):
+        if 'counts file' not in sources or not all(os.path.exists(f) for f in recorded):
+            # an older header does not say which file is which
+            return load_grammar(grammar_file)
+        rare_counts_file = sources['rare counts file']
+        counts_file = sources['counts file']
+        threshold = sources['rare threshold']
+    if is_stale(grammar_file, rare_counts_file, counts_file, threshold, pruning):
+        compile_grammar(rare_counts_file, counts_file, grammar_file, threshold, pruning)
+    return load_grammar(grammar_file)
+
+def usage():
+    sys.stderr.write("""
+    Usage: python pcfg.py [rare_counts_file] [counts_file] [grammar_file] [rare_threshold]
+        Compile the PCFG of a counts file to a binary grammar file.\n""")
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        usage()
+        sys.exit(1)
+    threshold = len(sys.argv) == 5 and int(sys.argv[4]) or RARE_THRESHOLD
+    compile_grammar(sys.argv[1], sys.argv[2], sys.argv[3], threshold)
@@ -3,7 +3,10 @@
 __author__="Alexander Rush <srush@csail.mit.edu>"
 __date__ ="$Sep 12, 2012"
 
-import sys, json, pprint
+import sys, pprint
+
+import treebank
+from tree_walk import preorder
 
 """
 Pretty print a tree from json.
@@ -22,12 +25,10 @@ def format_tree(tree):
   """
   Convert a tree with strings, to one with nodes.
   """
-  tree[0] = Node(tree[0])
-  if len(tree) == 2: 
-    tree[1] = Node(tree[1])
-  elif len(tree) == 3: 
-    format_tree(tree[1])
-    format_tree(tree[2])
+  for node in preorder(tree):
+    node[0] = Node(node[0])
+    if len(node) == 2:
+      node[1] = Node(node[1])
 
 def pretty_print_tree(tree):
   """
@@ -37,14 +38,14 @@ def pretty_print_tree(tree):
   print pprint.pformat(tree)
 
 def main(parse_file):
-  for l in open(parse_file):
-    pretty_print_tree(json.loads(l))
+  for tree in treebank.read_trees(parse_file):
+    pretty_print_tree(tree)
     
 
 def usage():
     sys.stderr.write("""
     Usage: python pretty_print_tree.py [tree_file]
-        Pretty print a file of trees.\n""")
+        Pretty print a file of json trees or a binary treebank.\n""")
 
 if __name__ == "__main__": 
   if len(sys.argv) != 2:
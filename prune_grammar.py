@@ -0,0 +1,102 @@
+#! /usr/bin/python
+"""
+Prune the binary rules of the PCFG and measure what it costs.
+
+python prune_grammar.py --top-k 10 --output cfg_rare.top10.pcfg
+writes a grammar that keeps the 10 most frequent binary rules of every
+nonterminal, normalized again so the rules of every X sum to one; parse
+with it by python 5.py ... --grammar cfg_rare.top10.pcfg (it is compiled
+again with the same pruning when the counts files change).
+
+python prune_grammar.py --min-count 1 2 5 --report parse_dev.dat parse_dev.key
+prints a tab-separated table of the grammar size, parsing time of the
+dev file and F1 score against the key file for every setting.
+"""
+
+import os
+import sys
+import argparse
+import itertools
+import tempfile
+
+import pcfg
+from scripts import parser_script, parse_and_evaluate
+
+parser_module = parser_script()
+
+def pruning_options(min_count, min_prob, top_k):
+    """
+    :return: the keyword arguments of pcfg.prune_rules, None for no pruning
+    """
+    pruning = {}
+    if min_count:
+        pruning['min_count'] = min_count
+    if min_prob:
+        pruning['min_prob'] = min_prob
+    if top_k:
+        pruning['top_k'] = top_k
+    return pruning or None
+
+def grammar_size(grammar):
+    """
+    :return: (binary rules, lexical rules) of a pcfg.Grammar
+    """
+    return len(grammar.rule_lhs), sum(len(tags) for tags, probs in grammar.lexicon.itervalues())
+
+def run_setting(dev_file, key_file, grammar_file, workers):
+    """
+    parse dev_file with a compiled grammar and evaluate it
+    :return: (seconds, sentences, precision, recall, F1)
+    """
+    seconds, stats, p, r, f = parse_and_evaluate(dev_file, key_file, 'cky', grammar_file,
+                                                 workers)
+    return seconds, stats['sentences'], p, r, f
+
+def report(dev_file, key_file, settings, workers):
+    print "\t".join(["min_count", "min_prob", "top_k", "binary_rules",
+                     "lexical_rules", "seconds", "sentences/s",
+                     "precision", "recall", "F1"])
+    for min_count, min_prob, top_k in settings:
+        fd, grammar_file = tempfile.mkstemp(suffix='.pcfg')
+        os.close(fd)
+        try:
+            pcfg.compile_grammar(parser_module.RARE_COUNTS_FILE, parser_module.COUNTS_FILE,
+                                 grammar_file,
+                                 pruning=pruning_options(min_count, min_prob, top_k))
+            binary, lexical = grammar_size(pcfg.load_grammar(grammar_file)[0])
+            seconds, sentences, p, r, f = run_setting(dev_file, key_file,
+                                                      grammar_file, workers)
+        finally:
+            os.remove(grammar_file)
+        print "%d\t%g\t%d\t%d\t%d\t%.3f\t%.1f\t%.4f\t%.4f\t%.4f" % (
+            min_count, min_prob, top_k, binary, lexical, seconds,
+            sentences / seconds, p, r, f)
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drop rare binary rules of the PCFG, then normalize it again.")
+    parser.add_argument('--min-count', type=int, nargs='+', default=[0],
+                        help="drop binary rules seen fewer times, 0 keeps all")
+    parser.add_argument('--min-prob', type=float, nargs='+', default=[0.0],
+                        help="drop binary rules of a lower probability, 0 keeps all")
+    parser.add_argument('--top-k', type=int, nargs='+', default=[0],
+                        help="keep the k most frequent binary rules of every "
+                             "nonterminal, 0 keeps all")
+    parser.add_argument('--output', default=None,
+                        help="write the compiled grammar of a single setting")
+    parser.add_argument('--report', nargs=2, default=None,
+                        metavar=('DEV_FILE', 'KEY_FILE'),
+                        help="parse and evaluate every setting")
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    settings = list(itertools.product(args.min_count, args.min_prob, args.top_k))
+    if not args.output and not args.report:
+        parser.error("give --output or --report")
+    if args.output:
+        if len(settings) != 1:
+            parser.error("--output takes a single setting")
+        pcfg.compile_grammar(parser_module.RARE_COUNTS_FILE, parser_module.COUNTS_FILE,
+                             args.output, pruning=pruning_options(*settings[0]))
+    if args.report:
+        report(args.report[0], args.report[1], settings, args.workers)
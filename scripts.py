@@ -0,0 +1,54 @@
+"""
+Helpers shared by the tools built on 4.py and 5.py: beam_sweep.py,
+prune_grammar.py, parse_server.py and benchmark.py.
+"""
+
+import os
+import imp
+import time
+import tempfile
+
+import eval_parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(name, filename):
+    """
+    4.py and 5.py cannot be imported by name
+    :return: the module of a script next to this file
+    """
+    return imp.load_source(name, os.path.join(HERE, filename))
+
+def parser_script():
+    """
+    :return: the module of 5.py, loaded once
+    """
+    global _parser_module
+    if _parser_module is None:
+        _parser_module = load_script('parser_5', '5.py')
+    return _parser_module
+
+_parser_module = None
+
+def parse_and_evaluate(dev_file, key_file, engine='cky', grammar_file=None,
+                       workers=1, **options):
+    """
+    parse dev_file with 5.py parse_corpus and evaluate it against key_file
+    :param options: see parse_corpus
+    :return: (seconds, parse_corpus stats, precision, recall, F1)
+    """
+    parser_module = parser_script()
+    fd, prediction_file = tempfile.mkstemp(suffix='.prediction')
+    os.close(fd)
+    try:
+        start = time.time()
+        stats = parser_module.parse_corpus(dev_file, prediction_file, engine,
+                                           grammar_file or parser_module.GRAMMAR_FILE,
+                                           workers, **options)
+        seconds = time.time() - start
+        right, total_gold, total_test = \
+            eval_parser.evaluate(key_file, prediction_file)[:3]
+    finally:
+        os.remove(prediction_file)
+    p, r, f = eval_parser.scores(right, total_gold, total_test)
+    return seconds, stats, p, r, f
@@ -0,0 +1,87 @@
+#! /usr/bin/python
+"""
+Build cfg.counts and cfg_rare.counts in one pass over the treebank.
+
+it replaces
+python count_cfg_freq.py parse_train.dat > cfg.counts
+python 4.py parse_train.dat parse_train_rare.dat
+python count_cfg_freq.py parse_train_rare.dat > cfg_rare.counts
+with
+python train_pipeline.py parse_train.dat cfg.counts cfg_rare.counts
+and writes the same two files, byte for byte (with --signatures, the
+same as 4.py --signatures).
+
+rare words only change the UNARYRULE counts, so the rare counts are made
+from the in-memory counts instead of rewriting and re-reading the trees.
+"""
+
+import json
+import argparse
+
+from count_cfg_freq import Counts
+from vocab import Vocabulary, RARE_THRESHOLD, file_checksum
+
+def count_treebank(tree_file):
+    """
+    :return: Counts of every tree in tree_file, in first-seen order.
+            count_cfg_freq.py prints its plain dicts in iteration order,
+            which depends on that insertion order, so it must be replayed
+            to print the same file
+    """
+    counter = Counts(ordered=True)
+    for l in open(tree_file):
+        counter.count(json.loads(l))
+    return counter
+
+def word_vocabulary(counts, threshold=RARE_THRESHOLD, signatures=False):
+    """
+    :return: Vocabulary with the total count of every word over its tags
+    """
+    word_counts = {}
+    for (sym, word), count in counts.unary.iteritems():
+        word_counts[word] = word_counts.get(word, 0) + count
+    return Vocabulary(word_counts, threshold, signatures)
+
+def replace_rare_words(counts, vocabulary):
+    """
+    the counts of the trees after 4.py replaced their rare words
+    :param counts: ordered Counts of the original trees
+    :return: ordered Counts where every (X, rare word) is merged into
+            (X, '_RARE_'), or (X, signature class), keys still in the
+            order they would be seen
+    """
+    rare = Counts(ordered=True)
+    rare.nonterm = counts.nonterm
+    rare.binary = counts.binary
+    for (sym, word), count in counts.unary.iteritems():
+        key = (sym, vocabulary.normalize(word))
+        rare.unary[key] = rare.unary.get(key, 0) + count
+    return rare
+
+def main(tree_file, counts_file, rare_counts_file, threshold=RARE_THRESHOLD,
+         vocab_file=None, signatures=False):
+    counts = count_treebank(tree_file)
+    with open(counts_file, 'w') as out:
+        counts.plain().show(out)
+    vocabulary = word_vocabulary(counts, threshold, signatures)
+    with open(rare_counts_file, 'w') as out:
+        replace_rare_words(counts, vocabulary).plain().show(out)
+    if vocab_file:
+        vocabulary.save(vocab_file, file_checksum(counts_file))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Count a treebank and its rare-word version in one pass.")
+    parser.add_argument('tree_file')
+    parser.add_argument('counts_file')
+    parser.add_argument('rare_counts_file')
+    parser.add_argument('--rare-threshold', type=int, default=RARE_THRESHOLD,
+                        help="words seen fewer times than this are rare")
+    parser.add_argument('--vocab', default=None,
+                        help="also write the vocabulary index of counts_file")
+    parser.add_argument('--signatures', action='store_true',
+                        help="replace rare words by their signature class, "
+                             "see vocab.word_class")
+    args = parser.parse_args()
+    main(args.tree_file, args.counts_file, args.rare_counts_file,
+         args.rare_threshold, args.vocab, args.signatures)
@@ -0,0 +1,21 @@
+"""
+Walk json trees (['X', ['Y1', ...], ['Y2', ...]] and ['X', word]) with an
+explicit stack, for 4.py, 5.py and the tree printers. there is no call per
+node and no limit on the depth of a tree.
+"""
+
+def preorder(tree):
+    """
+    :return: iterator over the nonterminal nodes of a tree, every node
+            before its children, left to right. a node may be changed in
+            place once it is yielded, as long as its children stay
+    """
+    stack = [tree]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node = pop()
+        yield node
+        if len(node) == 3:
+            push(node[2])
+            push(node[1])
@@ -0,0 +1,216 @@
+#! /usr/bin/python
+"""
+Compact binary form of a file of json trees, such as parse_train.dat.
+
+every distinct nonterminal and word is stored once in a symbol table and
+the trees are flat preorder arrays: the symbol of every node, its arity
+(2 for X -> Y1 Y2, 1 for X -> word, 0 for the word itself) and the number
+of nodes of its subtree. the arrays are memory-mapped, so the tools can
+work on them with array operations instead of decoding json into nested
+lists on every run.
+
+convert once with
+python treebank.py parse_train.dat parse_train.tbk
+and back with
+python treebank.py --json parse_train.tbk parse_train.dat
+count_cfg_freq.py, 4.py, eval_parser.py and pretty_print_tree.py take
+either format.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+
+from pcfg import save_arrays, load_arrays, pack_strings, unpack_strings
+
+MAGIC = 'TREEBIN1'
+
+def is_treebank(path):
+    """
+    :return: True if path is a binary treebank, False for json trees.
+            only a regular file is read to check: a pipe cannot be read
+            twice, and it is taken as json trees (a treebank is
+            memory-mapped, it must be a file anyway)
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def index_array(values, bound):
+    """
+    :return: values as uint16 if every one is below bound and bound fits,
+            int32 otherwise
+    """
+    return np.asarray(values, dtype=np.uint16 if bound <= 1 << 16 else np.int32)
+
+def encode_tree(tree, index, symbol, arity):
+    """
+    append the preorder nodes of a json tree to the symbol and arity lists
+    :param index: {name: symbol}, new names are added to it
+    :return: the subtree sizes of the appended nodes, in preorder
+    """
+    first = len(symbol)
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, basestring):
+            name, children = node, []
+        else:
+            name, children = node[0], node[1:]
+        symbol.append(index.setdefault(name, len(index)))
+        arity.append(len(children))
+        stack.extend(reversed(children))
+    # sizes from the last node back: the children of a node are done
+    # before it, and the top of the stack is its leftmost child
+    sizes = [0] * (len(symbol) - first)
+    done = []
+    for p in range(len(sizes) - 1, -1, -1):
+        size = 1
+        for c in range(arity[first + p]):
+            size += done.pop()
+        sizes[p] = size
+        done.append(size)
+    return sizes
+
+def write_treebank(trees, path):
+    """
+    write an iterable of json trees as a binary treebank
+    """
+    index = {}
+    symbol = []
+    arity = []
+    size = []
+    tree_start = [0]
+    for tree in trees:
+        size.extend(encode_tree(tree, index, symbol, arity))
+        tree_start.append(len(symbol))
+    name_blob, name_offsets = pack_strings(sorted(index, key=index.get))
+    save_arrays(path, MAGIC, {}, [
+        ('name_blob', name_blob), ('name_offsets', name_offsets),
+        ('symbol', index_array(symbol, len(index))),
+        ('arity', np.asarray(arity, dtype=np.int8)),
+        ('size', index_array(size, max(size or [0]) + 1)),
+        ('tree_start', np.asarray(tree_start, dtype=np.int64)),
+    ])
+
+def save_treebank(treebank, path, symbol=None, names=None):
+    """
+    write the trees of a Treebank, optionally with new node symbols or
+    symbol table, without decoding them
+    """
+    names = treebank.names if names is None else names
+    name_blob, name_offsets = pack_strings(names)
+    save_arrays(path, MAGIC, {}, [
+        ('name_blob', name_blob), ('name_offsets', name_offsets),
+        ('symbol', treebank.symbol if symbol is None else index_array(symbol, len(names))),
+        ('arity', treebank.arity), ('size', treebank.size),
+        ('tree_start', treebank.tree_start),
+    ])
+
+class Treebank(object):
+    """
+    read-only, memory-mapped binary treebank. tree k is the nodes
+    tree_start[k] to tree_start[k + 1] of the symbol, arity and size arrays
+    """
+    def __init__(self, path):
+        header, a = load_arrays(path, MAGIC)
+        # unicode, as json.loads returns them
+        self.names = [s.decode('utf-8')
+                      for s in unpack_strings(a['name_blob'], a['name_offsets'])]
+        self.json_names = [json.dumps(name) for name in self.names]
+        self.symbol = a['symbol']
+        self.arity = a['arity']
+        self.size = a['size']
+        self.tree_start = a['tree_start']
+
+    def __len__(self):
+        return len(self.tree_start) - 1
+
+    def right_child(self, nodes):
+        """
+        :param nodes: positions of binary nodes
+        :return: positions of their right children
+        """
+        return nodes + 1 + self.size[nodes + 1]
+
+    def tree(self, k):
+        """
+        :return: tree k as nested lists, the same as json.loads of its line
+        """
+        names = self.names
+        start, end = self.tree_start[k], self.tree_start[k + 1]
+        root = []
+        # lists still missing children, and how many
+        stack = [(root, 1)]
+        for s, a in zip(self.symbol[start:end].tolist(), self.arity[start:end].tolist()):
+            parent, missing = stack.pop()
+            if missing > 1:
+                stack.append((parent, missing - 1))
+            if a == 0:
+                parent.append(names[s])
+            else:
+                node = [names[s]]
+                parent.append(node)
+                stack.append((node, a))
+        return root[0]
+
+    def tree_json(self, k):
+        """
+        :return: tree k as json, the same text as json.dumps of tree(k)
+        """
+        names = self.json_names
+        start, end = self.tree_start[k], self.tree_start[k + 1]
+        pieces = []
+        # children still missing under every open node
+        stack = []
+        for s, a in zip(self.symbol[start:end].tolist(), self.arity[start:end].tolist()):
+            if stack:
+                pieces.append(', ')
+            if a:
+                pieces.append('[' + names[s])
+                stack.append(a)
+                continue
+            pieces.append(names[s])
+            # a word ends its parent, and every node whose last child it was
+            while stack:
+                stack[-1] -= 1
+                if stack[-1]:
+                    break
+                stack.pop()
+                pieces.append(']')
+        return ''.join(pieces)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.tree(k)
+
+def read_trees(path):
+    """
+    :return: an iterator over the json trees of a json or binary file
+    """
+    if is_treebank(path):
+        return iter(Treebank(path))
+    return (json.loads(l) for l in open(path))
+
+def usage():
+    sys.stderr.write("""
+    Usage: python treebank.py [--json] [tree_file] [output_file]
+        Convert a file of json trees to a binary treebank, or back with --json.\n""")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    to_json = args[:1] == ['--json']
+    if to_json:
+        args = args[1:]
+    if len(args) != 2:
+        usage()
+        sys.exit(1)
+    if to_json:
+        treebank = Treebank(args[0])
+        with open(args[1], 'w') as out:
+            for k in range(len(treebank)):
+                out.write(treebank.tree_json(k) + '\n')
+    else:
+        write_treebank(read_trees(args[0]), args[1])
@@ -0,0 +1,179 @@
+#! /usr/bin/python
+"""
+Add newly annotated trees to an existing grammar without recounting the
+treebank.
+
+python update_grammar.py new_trees.dat cfg.counts cfg_rare.counts
+adds the counts of the new trees to both counts files in place. words
+whose total count crosses the rare threshold have their mass moved into
+or out of '_RARE_' (or their signature class with --signatures, see
+vocab.word_class), and the vocabulary index and the compiled grammar are
+updated: the rows of the parameter table whose counts changed are
+normalized again, the others are read from the compiled grammar. a
+grammar pruned by prune_grammar.py is pruned again with the same
+settings.
+
+the counts files hold the same counts as recounting all the trees, but
+their lines may be in a different order.
+"""
+
+import sys
+import argparse
+
+import pcfg
+import treebank
+from count_cfg_freq import Counts
+from pcfg import build_para_dict
+from vocab import open_vocabulary, RARE_THRESHOLD, file_checksum
+
+VOCAB_FILE = 'cfg.vocab'
+GRAMMAR_FILE = 'cfg_rare.pcfg'
+
+def count_trees(tree_file):
+    """
+    :return: ordered Counts of a file of json trees or a binary treebank
+    """
+    counts = Counts(ordered=True)
+    if treebank.is_treebank(tree_file):
+        return counts.count_treebank(treebank.Treebank(tree_file))
+    for tree in treebank.read_trees(tree_file):
+        counts.count(tree)
+    return counts
+
+def add(d, key, count):
+    """
+    add to a count, removing it when it drops to 0
+    """
+    count += d.get(key, 0)
+    if count:
+        d[key] = count
+    else:
+        del d[key]
+
+def add_counts(counts, rare, vocabulary, new):
+    """
+    add the counts of new trees in place
+    :param counts: Counts of cfg.counts, with the original words
+    :param rare: Counts of cfg_rare.counts, rare words as '_RARE_' or
+            their signature class
+    :param vocabulary: Vocabulary of counts, its word totals are updated
+    :param new: Counts of the new trees
+    :return: {X: {rhs: change}} of the rule counts of rare, with the
+            right-hand sides written as in build_rule_count_dict
+    """
+    changes = {}
+
+    def change(d, key, count):
+        add(d, key, count)
+        x, rhs = key[0], ' '.join(key[1:])
+        changes.setdefault(x, {})
+        changes[x][rhs] = changes[x].get(rhs, 0) + count
+
+    for x, count in new.nonterm.iteritems():
+        add(counts.nonterm, x, count)
+        add(rare.nonterm, x, count)
+    for key, count in new.binary.iteritems():
+        add(counts.binary, key, count)
+        change(rare.binary, key, count)
+
+    tags = {}
+    for (x, w), count in new.unary.iteritems():
+        add(counts.unary, (x, w), count)
+        tags.setdefault(w, []).append(x)
+    for w in tags:
+        was_rare = vocabulary.is_rare(w)
+        vocabulary.counts[w] = vocabulary.counts.get(w, 0) + \
+            sum(new.unary[(x, w)] for x in tags[w])
+        if was_rare == vocabulary.is_rare(w):
+            target = was_rare and vocabulary.rare_class(w) or w
+            for x in tags[w]:
+                change(rare.unary, (x, target), new.unary[(x, w)])
+            continue
+        # the word crossed the threshold: move what it had before from
+        # one side to the other, and add all it has now there
+        rare_class = vocabulary.rare_class(w)
+        old_target, new_target = was_rare and (rare_class, w) or (w, rare_class)
+        for x in counts.nonterm:
+            count = counts.unary.get((x, w), 0)
+            if count:
+                before = count - new.unary.get((x, w), 0)
+                if before:
+                    change(rare.unary, (x, old_target), -before)
+                change(rare.unary, (x, new_target), count)
+    return changes
+
+def rule_counts(counts):
+    """
+    :return: the build_rule_count_dict table of Counts
+    """
+    rule_count_dict = {}
+    for (x, w), count in counts.unary.iteritems():
+        rule_count_dict.setdefault(x, {})[w] = count
+    for (x, y1, y2), count in counts.binary.iteritems():
+        rule_count_dict.setdefault(x, {})[y1 + ' ' + y2] = count
+    return rule_count_dict
+
+def renormalize(para_dict, rule_count_dict, rows):
+    """
+    normalize again the rows of a build_para_dict table whose counts changed
+    :param rows: left-hand sides to update
+    """
+    for x in rows:
+        if x in rule_count_dict:
+            para_dict.update(build_para_dict({x: rule_count_dict[x]}))
+        else:
+            para_dict.pop(x, None)
+
+def main(tree_file, counts_file, rare_counts_file, threshold=RARE_THRESHOLD,
+         vocab_file=VOCAB_FILE, grammar_file=GRAMMAR_FILE, signatures=False):
+    with open(counts_file) as f:
+        counts = Counts(ordered=True).load(f)
+    with open(rare_counts_file) as f:
+        rare = Counts(ordered=True).load(f)
+    vocabulary = open_vocabulary(counts_file, vocab_file, threshold, signatures)
+    pruning = pcfg.grammar_pruning(grammar_file)
+    stale = pcfg.is_stale(grammar_file, rare_counts_file, counts_file, threshold, pruning)
+
+    changes = add_counts(counts, rare, vocabulary, count_trees(tree_file))
+    rule_count_dict = rule_counts(rare)
+    if pruning:
+        # new counts may bring rules back in or push them out
+        rule_count_dict = pcfg.prune_rules(rule_count_dict, **pruning)
+        para_dict = build_para_dict(rule_count_dict)
+        rows = len(para_dict)
+    elif stale:
+        # the compiled grammar does not hold the counts being updated
+        para_dict = build_para_dict(rule_count_dict)
+        rows = len(para_dict)
+    else:
+        para_dict = pcfg.load_grammar(grammar_file)[0].parameters()
+        renormalize(para_dict, rule_count_dict, changes)
+        rows = len(changes)
+
+    with open(counts_file, 'w') as out:
+        counts.plain().show(out)
+    with open(rare_counts_file, 'w') as out:
+        rare.plain().show(out)
+    vocabulary.save(vocab_file, file_checksum(counts_file))
+    pcfg.save_grammar(pcfg.Grammar.from_parameters(para_dict, rule_count_dict),
+                      vocabulary.frequent_words(),
+                      pcfg.grammar_sources(rare_counts_file, counts_file, threshold, pruning),
+                      grammar_file)
+    sys.stderr.write("%d rows of %d normalized again\n" % (rows, len(para_dict)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Add new trees to the counts files and the compiled grammar.")
+    parser.add_argument('tree_file', help="new trees, json or a binary treebank")
+    parser.add_argument('counts_file')
+    parser.add_argument('rare_counts_file')
+    parser.add_argument('--rare-threshold', type=int, default=RARE_THRESHOLD,
+                        help="words seen fewer times than this are rare")
+    parser.add_argument('--vocab', default=VOCAB_FILE)
+    parser.add_argument('--grammar', default=GRAMMAR_FILE)
+    parser.add_argument('--signatures', action='store_true',
+                        help="the counts files were made with rare words replaced "
+                             "by their signature class, see vocab.word_class")
+    args = parser.parse_args()
+    main(args.tree_file, args.counts_file, args.rare_counts_file,
+         args.rare_threshold, args.vocab, args.grammar, args.signatures)
@@ -0,0 +1,166 @@
+#! /usr/bin/python
+"""
+Word counts of the training data and the rare/frequent word split shared
+by 4.py (rewriting the training trees) and 5.py (parsing)
+
+build the persisted index once with
+python vocab.py cfg.counts cfg.vocab
+"""
+
+import sys
+import hashlib
+
+RARE = '_RARE_'
+RARE_THRESHOLD = 5 # words seen fewer times than this are rare
+# unknown-word signature classes, see word_class
+SIGNATURES = ['_RARE_NUM_', '_RARE_HYPHEN_', '_RARE_ALLCAPS_', '_RARE_CAP_',
+              '_RARE_ING_', '_RARE_ED_', '_RARE_LY_', '_RARE_S_']
+
+def word_class(word):
+    """
+    :return: the signature class of a rare word, from the first test it
+            passes: it has a digit, a hyphen, only capitals, a capital
+            first letter, or ends in -ing, -ed, -ly or -s; '_RARE_' if none
+    """
+    if any(c.isdigit() for c in word):
+        return '_RARE_NUM_'
+    if '-' in word:
+        return '_RARE_HYPHEN_'
+    if word.isupper():
+        return '_RARE_ALLCAPS_'
+    if word[:1].isupper():
+        return '_RARE_CAP_'
+    for suffix in ('ing', 'ed', 'ly', 's'):
+        if word.endswith(suffix) and len(word) > len(suffix) + 1:
+            return '_RARE_%s_' % suffix.upper()
+    return RARE
+
+def rare_word(word, classes=None):
+    """
+    the replacement of a rare word at parse time
+    :param classes: signature classes the grammar knows, None to use
+            '_RARE_' alone
+    :return: the signature class of the word if it is in classes,
+            '_RARE_' otherwise
+    """
+    if classes:
+        c = word_class(word)
+        if c in classes:
+            return c
+    return RARE
+
+def file_checksum(path):
+    """
+    :return: sha1 hex digest of the content of a file
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            h.update(block)
+    return h.hexdigest()
+
+class Vocabulary(object):
+    """
+    total count of every word over all its tags
+    """
+    def __init__(self, counts, threshold=RARE_THRESHOLD, signatures=False):
+        """
+        :param counts: {word: count}
+        :param threshold: a word is rare if it appears fewer times than this
+        :param signatures: replace rare words by their signature class
+                (see word_class) instead of '_RARE_'
+        """
+        self.counts = counts
+        self.threshold = threshold
+        self.signatures = signatures
+
+    @classmethod
+    def from_counts_file(cls, count_file, threshold=RARE_THRESHOLD, signatures=False):
+        """
+        sum the UNARYRULE counts of every word in one pass
+        :param count_file: files created by run command line:
+                python count_cfg_freq.py parse_train.dat > cfg.counts
+        """
+        counts = {}
+        with open(count_file) as f:
+            for line in f:
+                l = line.split()
+                if l[1] == 'UNARYRULE':
+                    counts[l[3]] = counts.get(l[3], 0) + int(l[0])
+        return cls(counts, threshold, signatures)
+
+    def is_rare(self, word):
+        return self.counts.get(word, 0) < self.threshold
+
+    def is_frequent(self, word):
+        return self.counts.get(word, 0) >= self.threshold
+
+    def rare_class(self, word):
+        """
+        :return: what the word is replaced with if it is rare
+        """
+        return word_class(word) if self.signatures else RARE
+
+    def normalize(self, word):
+        """
+        :return: the word as the grammar knows it, '_RARE_' or its
+                signature class for rare words
+        """
+        return word if self.is_frequent(word) else self.rare_class(word)
+
+    def rare_words(self):
+        return set(w for w, c in self.counts.iteritems() if c < self.threshold)
+
+    def frequent_words(self):
+        return set(w for w, c in self.counts.iteritems() if c >= self.threshold)
+
+    def save(self, vocab_file, source=None):
+        """
+        write one 'count word' line per word, after a header with the
+        checksum of the counts file the vocabulary came from
+        """
+        with open(vocab_file, 'w') as f:
+            f.write('# %s\n' % (source or ''))
+            for w, c in self.counts.iteritems():
+                f.write('%d %s\n' % (c, w))
+
+    @classmethod
+    def load(cls, vocab_file, threshold=RARE_THRESHOLD, signatures=False):
+        """
+        :return: (vocabulary, checksum of its counts file)
+        """
+        counts = {}
+        with open(vocab_file) as f:
+            source = f.readline()[2:].strip()
+            for line in f:
+                c, w = line.split()
+                counts[w] = int(c)
+        return cls(counts, threshold, signatures), source
+
+def open_vocabulary(count_file, vocab_file, threshold=RARE_THRESHOLD, signatures=False):
+    """
+    load the persisted vocabulary of count_file, rebuilding it first if it
+    is missing or was built from a different counts file
+    """
+    checksum = file_checksum(count_file)
+    try:
+        vocabulary, source = Vocabulary.load(vocab_file, threshold, signatures)
+        if source == checksum:
+            return vocabulary
+    except (IOError, ValueError):
+        pass
+    vocabulary = Vocabulary.from_counts_file(count_file, threshold, signatures)
+    vocabulary.save(vocab_file, checksum)
+    return vocabulary
+
+def usage():
+    sys.stderr.write("""
+    Usage: python vocab.py [count_file] [vocab_file]
+        Build the word count index of a counts file.\n""")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        usage()
+        sys.exit(1)
+    count_file = sys.argv[1]
+    Vocabulary.from_counts_file(count_file).save(sys.argv[2], file_checksum(count_file))